@@ -1,7 +1,29 @@
 import streamlit as st
-import anthropic
+import io
+import os
+import tempfile
+from collections import deque
+from dataclasses import dataclass
 from datetime import datetime
-import base64
+from itertools import islice
+
+from archive import Archive, default_archive
+from cache import GenerationCache, default_cache
+from clients import ClientManager, is_auth_error
+from generation import (SectionError, generate_newsletter, generate_sections, generate_structured, max_tokens_for,
+                        rewrite_fields, stream_newsletter)
+from images import ImageError, format_bytes, prepare_image, to_cid_email, to_zip, zip_files
+from optimize import GMAIL_CLIP_BYTES, INLINE_IMAGE_BYTES, WARN_BYTES, SizeBudget, optimize_html
+from parsing import tool_schema
+from prompts import (FIELDS, FORMAT_SPEC, REWRITABLE, SECTIONS, STATE_KEYS, build_prompt, build_rewrite_prompt,
+                     length_instruction_for)
+from personalize import Personalizer, parse_segment_links, personalize, read_recipients, recipient_columns
+from render import (DEFAULT_PALETTE, content_hash, newsletter_from_state, newsletter_to_json, render_newsletter,
+                    render_plain_text)
+from sinks import open_sink
+from jobs import JobQueue
+from research import ResearchCache, default_backend, research, research_queries
+from tracing import Tracer, default_tracer
 
 # Page config
 st.set_page_config(
@@ -10,185 +32,644 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize session state
+# Initialize session state: flags plus the editable content, set once per session
+SESSION_DEFAULTS = {'preview_generated': False, 'edit_mode': False, **{field: "" for _, field in FIELDS}}
 if 'preview_generated' not in st.session_state:
-    st.session_state.preview_generated = False
-if 'edit_mode' not in st.session_state:
-    st.session_state.edit_mode = False
+    for key, value in SESSION_DEFAULTS.items():
+        st.session_state.setdefault(key, value)
+
+# Built on the first run of the server process and shared by every session
+# after it, all from one cached call
+@dataclass(frozen=True)
+class Resources:
+    generation_cache: GenerationCache
+    tracer: Tracer
+    # One pooled client and one rate limit per API key
+    client_manager: ClientManager
+    # Web research for the optional research stage; searches are cached on disk
+    # DuckDuckGo, or fixture files for working offline
+    research_backend: object
+    research_cache: ResearchCache
+    archive: Archive
+    # Generations run on a worker pool, so a long call doesn't hold a script
+    # thread and a page reload doesn't lose it
+    job_queue: JobQueue
+    structured_tool: dict
+
+@st.cache_resource
+def get_resources():
+    return Resources(
+        generation_cache=default_cache(),
+        tracer=default_tracer(),
+        client_manager=ClientManager(),
+        research_backend=default_backend(),
+        research_cache=ResearchCache(),
+        archive=default_archive(),
+        job_queue=JobQueue(max_workers=int(os.environ.get('NEWSIE_JOB_WORKERS', 8)),
+                           per_key=int(os.environ.get('NEWSIE_JOBS_PER_KEY', 2))),
+        structured_tool=tool_schema(FORMAT_SPEC),
+    )
+
+resources = get_resources()
+generation_cache = resources.generation_cache
+tracer = resources.tracer
+client_manager = resources.client_manager
+research_backend = resources.research_backend
+research_cache = resources.research_cache
+archive = resources.archive
+job_queue = resources.job_queue
+structured_tool = resources.structured_tool
+
+# Traces are only recorded while the Performance panel's toggle is on
+def start_trace(name, **attrs):
+    return tracer.start(name, enabled=st.session_state.get('trace_enabled', tracer.enabled), **attrs)
 
-# Store editable content
-for field in ['subj1', 'subj2', 'subj3', 'hook', 'main_thing', 'ceo_note', 
-              'p1_title', 'p1_content', 'p2_title', 'p2_content', 'p3_title', 'p3_content',
-              'cta_btn', 'ps']:
-    if field not in st.session_state:
-        st.session_state[field] = ""
+def finish_trace(trace):
+    keep_trace(tracer.finish(trace))
+
+def keep_trace(record):
+    if record is not None:
+        st.session_state.setdefault('traces', deque(maxlen=10)).append(record)
+
+def show_traces():
+    traces = st.session_state.get('traces')
+    if not traces:
+        st.caption("No traces yet. Turn on recording, then generate or edit a newsletter.")
+        return
+    for record in reversed(traces):
+        st.markdown(f"**{record['trace']}** · {record['total_s'] * 1000:,.1f} ms")
+        spans = ' · '.join(f"{span} {seconds * 1000:,.1f} ms" + (f" ×{record['calls'][span]}" if record['calls'][span] > 1 else "")
+                           for span, seconds in record['spans'].items())
+        details = []
+        usage = record.get('usage')
+        if usage:
+            details.append(f"{usage['input_tokens'] + usage['cache_read_input_tokens'] + usage['cache_creation_input_tokens']:,} in "
+                           f"({usage['cache_read_input_tokens']:,} cached) / {usage['output_tokens']:,} out tokens")
+        if record.get('html_bytes'):
+            details.append(f"HTML {format_bytes(record['html_bytes'])}")
+        if record.get('iframe_bytes'):
+            details.append(f"iframe payload {format_bytes(record['iframe_bytes'])}")
+        st.caption(' · '.join(filter(None, [spans, *details])))
 
 # Helper functions
-def get_image_src(uploaded_file, url):
+# An upload that can't be read is left out, with a warning, rather than
+# failing the whole generation
+def get_image(uploaded_file):
     if uploaded_file is not None:
-        bytes_data = uploaded_file.getvalue()
-        b64 = base64.b64encode(bytes_data).decode()
-        return f"data:{uploaded_file.type};base64,{b64}"
+        try:
+            return prepare_image(uploaded_file.getvalue(), uploaded_file.type)
+        except ImageError as e:
+            st.session_state.image_warnings.append(f"{uploaded_file.name} was left out: {e}")
+    return None
+
+def show_image_warnings():
+    for warning in st.session_state.get('image_warnings', []):
+        st.warning(f"🖼️ {warning}")
+
+def get_image_src(image, url):
+    if image is not None:
+        return image.data_uri
     elif url and url.strip():
         return url.strip()
     return None
 
-def get_image_html(image_src, section_name):
-    if image_src:
-        return f'<img src="{image_src}" alt="{section_name}" style="width: 100%; height: 160px; object-fit: cover; border-radius: 8px; margin-bottom: 12px;">'
-    return f'<div style="width: 100%; height: 120px; background: linear-gradient(135deg, #f8f9fa 0%, #e9ecef 100%); border-radius: 8px; margin-bottom: 12px; display: flex; align-items: center; justify-content: center; color: #adb5bd; font-size: 13px; border: 2px dashed #dee2e6;">📷 Add {section_name} image</div>'
-
-def build_html(org_name, org_tagline, org_website, org_logo, primary, secondary, accent, text_color,
-               section_label, hook, main_thing, ceo_note,
-               p1_name, p1_title, p1_content, p1_img,
-               p2_name, p2_title, p2_content, p2_img,
-               p3_name, p3_title, p3_content, p3_img,
-               cta_btn, cta_link, ps):
+def session_html():
+    return render_newsletter(newsletter_from_state(st.session_state))
+
+# Edit-mode widget key for each editable field
+EDIT_KEYS = {
+    'subj1': 'ed_s1', 'subj2': 'ed_s2', 'subj3': 'ed_s3',
+    'hook': 'ed_hook', 'main_thing': 'ed_main', 'ceo_note': 'ed_ceo',
+    'p1_title': 'ed_p1t', 'p1_content': 'ed_p1c',
+    'p2_title': 'ed_p2t', 'p2_content': 'ed_p2c',
+    'p3_title': 'ed_p3t', 'p3_content': 'ed_p3c',
+    'cta_btn': 'ed_cta', 'cta_link': 'ed_link', 'ps': 'ed_ps',
+}
+
+# Copies what was submitted in the edit form into the newsletter fields
+def apply_edits():
+    for field, key in EDIT_KEYS.items():
+        if key in st.session_state:
+            st.session_state[field] = st.session_state[key]
+
+# Button callback, so the new copy is in place before the edit widgets are drawn
+def rewrite_section(section, api_key):
+    # Keep anything typed in the form, and let the rewrite see it
+    apply_edits()
+    if not api_key:
+        st.session_state.rewrite_error = "Please enter your Anthropic API key in the sidebar."
+        return
+    labels = REWRITABLE[section]
+    trace = start_trace('rewrite', section=section)
+    current = {label: st.session_state[field] for label, field in FIELDS}
+    prompt_args = st.session_state.prompt_args
+    with trace.span('prompt'):
+        prompt = build_rewrite_prompt(*prompt_args, current=current, labels=labels,
+                                      research=st.session_state.get('research_notes', ''))
+    max_tokens = max_tokens_for(labels, prompt_args[-1])
+    try:
+        with st.spinner("✨ Rewriting..."):
+            parsed, metrics = rewrite_fields(client_manager.client(api_key), prompt, labels, max_tokens, trace=trace)
+        trace.set(usage=metrics['usage'])
+    except Exception as e:
+        if is_auth_error(e):
+            st.session_state.rewrite_error = "Invalid API key. Please check your Anthropic API key."
+        else:
+            st.session_state.rewrite_error = f"Error: {str(e)}"
+        return
+    finally:
+        finish_trace(trace)
+    for label, value in parsed.items():
+        field = STATE_KEYS[label]
+        st.session_state[field] = value
+        # Drop the widget's own state so it picks up the new value
+        st.session_state.pop(EDIT_KEYS[field], None)
+    written = ', '.join(label.replace('_', ' ').lower() for label in labels)
+    st.session_state.rewrite_notice = f"Rewrote {written} in {metrics['total_s']:.1f}s"
+
+def rewrite_button(section, api_key):
+    st.form_submit_button("🔁 Regenerate", key=f"rw_{section}", on_click=rewrite_section, args=(section, api_key),
+                          disabled='prompt_args' not in st.session_state,
+                          help="Ask Claude for fresh copy for just this part")
+
+# Set in the sidebar's Email size panel
+def size_options():
+    base_url = st.session_state.get('size_image_base_url', '').strip()
+    if base_url and not base_url.endswith('/'):
+        base_url += '/'
+    budget = SizeBudget(warn_bytes=st.session_state.get('size_warn_kb', WARN_BYTES // 1024) * 1024,
+                        limit_bytes=st.session_state.get('size_limit_kb', GMAIL_CLIP_BYTES // 1024) * 1024,
+                        inline_image_bytes=st.session_state.get('size_inline_kb', INLINE_IMAGE_BYTES // 1024) * 1024,
+                        image_base_url=base_url)
+    return budget, st.session_state.get('size_style_classes', False)
+
+# HTML and plain text for the current newsletter, keyed by its content hash.
+# Reruns that didn't change the newsletter reuse them as they are. 'html' is
+# the optimized HTML with every image inline, for the preview and the .eml
+# and .zip downloads; 'optimized' is the HTML download, with oversized
+# images moved out, and its size report.
+def session_exports():
+    doc = newsletter_from_state(st.session_state)
+    key = content_hash(doc)
+    options = size_options()
+    exports = st.session_state.get('exports')
+    if exports is None or exports['hash'] != key or exports.get('options') != options:
+        changed = exports is None or exports['hash'] != key
+        trace = start_trace('render')
+        with trace.span('render_html'):
+            html = render_newsletter(doc)
+        with trace.span('optimize'):
+            optimized = optimize_html(html, *options)
+            html = optimized.inline_html()
+        with trace.span('render_text'):
+            plain = render_plain_text(doc)
+        trace.set(html_bytes=optimized.size, iframe_bytes=len(html.encode('utf-8')))
+        if changed:
+            with trace.span('archive'):
+                archive_issue(key, html)
+        finish_trace(trace)
+        exports = {'hash': key, 'options': options, 'html': html, 'optimized': optimized, 'plain': plain}
+        st.session_state.exports = exports
+    return exports
+
+SIZE_STEPS = {'styles': "styles", 'style_classes': "shared styles", 'whitespace': "whitespace",
+              'images': "images moved out"}
+
+def show_size_report(optimized):
+    saved = ', '.join(f"{SIZE_STEPS[step]} −{format_bytes(size)}" for step, size in optimized.saved.items() if size)
+    report = (f"📏 HTML is {format_bytes(optimized.size)} of a {format_bytes(optimized.budget.limit_bytes)} limit"
+              + (f" (was {format_bytes(optimized.original_bytes)}; {saved})" if saved else ""))
+    if optimized.status == 'over':
+        fix = ""
+        if 'data:image/' in optimized.html:
+            fix = (", or allow fewer inline image bytes" if optimized.budget.image_base_url
+                   else ", or set an image host URL so images are linked instead of inline")
+            fix += " in the sidebar's Email size panel"
+        st.error(f"{report}. Gmail will clip it behind \"[Message clipped]\": shorten the copy{fix}.")
+    elif optimized.status == 'warn':
+        st.warning(f"{report}, close to where Gmail clips.")
+    else:
+        st.caption(report)
+
+def session_images():
+    return [(n, st.session_state[f'p{n}_image']) for n in (1, 2, 3) if st.session_state.get(f'p{n}_image') is not None]
+
+# Switching the image mode only reruns this fragment. The .eml and .zip
+# payloads are built the first time they're asked for and then kept with
+# the rest of the exports until the newsletter changes.
+@st.fragment
+def download_section():
+    exports = session_exports()
+    images = [image for _, image in session_images()]
+    html = exports['html']
+    file_stem = f"newsletter_{datetime.now().strftime('%Y%m%d')}"
+    image_mode = "Inline in the HTML"
+    if images:
+        image_mode = st.radio("Images in the download", ["Inline in the HTML", "Email with attachments (.eml)",
+                                                         "HTML + image files (.zip)"], horizontal=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        if image_mode == "Email with attachments (.eml)":
+            if 'eml' not in exports:
+                exports['eml'] = to_cid_email(html, images, st.session_state.subj1, exports['plain'])
+            st.download_button("📥 Download Email", exports['eml'], f"{file_stem}.eml", "message/rfc822", use_container_width=True)
+        elif image_mode == "HTML + image files (.zip)":
+            if 'zip' not in exports:
+                exports['zip'] = to_zip(html, images, f"{file_stem}.html")
+            st.download_button("📥 Download HTML + Images", exports['zip'], f"{file_stem}.zip", "application/zip", use_container_width=True)
+        else:
+            optimized = exports['optimized']
+            blocked = optimized.status == 'over' and st.session_state.get('size_action') == "Block the download"
+            if optimized.moved:
+                # The moved images go with the HTML, ready to upload to the image host
+                if 'html_zip' not in exports:
+                    exports['html_zip'] = zip_files(optimized.html, optimized.files, f"{file_stem}.html")
+                st.download_button("📥 Download HTML", exports['html_zip'], f"{file_stem}.zip", "application/zip",
+                                   disabled=blocked, use_container_width=True)
+                st.caption(f"{len(optimized.moved)} image(s) over {format_bytes(optimized.budget.inline_image_bytes)} "
+                           f"link to {optimized.budget.image_base_url}; upload the images folder there.")
+            else:
+                st.download_button("📥 Download HTML", optimized.html, f"{file_stem}.html", "text/html",
+                                   disabled=blocked, use_container_width=True)
+            if blocked:
+                st.caption("🚫 Over the size limit, so the HTML download is blocked.")
+    with col2:
+        st.download_button("📄 Download Text", exports['plain'], f"{file_stem}.txt", "text/plain", use_container_width=True)
+
+# The finished copies are held in the server's memory to be downloaded (at
+# ~100 KB each with an inline image), so the UI builds lists up to this size.
+# personalize.py writes to disk as it goes and has no limit.
+PERSONALIZE_MAX_RECIPIENTS = 1000
+
+PERSONALIZED_OUTPUTS = {
+    "HTML files (.zip)": ('html', 'zip', "application/zip"),
+    "Emails (.zip of .eml)": ('eml', 'zip', "application/zip"),
+    "Mailbox (.mbox)": ('eml', 'mbox', "application/mbox"),
+}
+
+# One copy of the newsletter per recipient, built into a temp file one
+# recipient at a time. Lists over PERSONALIZE_MAX_RECIPIENTS are sent to
+# personalize.py with the newsletter data file.
+@st.fragment
+def personalize_section():
+    doc = newsletter_from_state(st.session_state)
+    file_stem = f"newsletter_{datetime.now().strftime('%Y%m%d')}"
+    st.caption("Upload a CSV with an **email** column (plus first_name, segment or anything else). Each copy opens "
+               "with \"Hi {{first_name}},\", and any column can be used in the copy as {{column}} or "
+               f"{{{{column|fallback}}}}. Up to {PERSONALIZE_MAX_RECIPIENTS:,} recipients here; for bigger lists "
+               "use personalize.py with the newsletter data file.")
+    recipients = st.file_uploader("Recipients (.csv)", type=['csv'], key="recipients_csv")
+    unsubscribe_url = st.text_input("Unsubscribe URL", key="unsubscribe_url",
+                                    placeholder="https://yourorg.org/unsubscribe?email={email}")
+    segment_links = st.text_area("CTA link per segment (optional)", key="segment_links", height=80,
+                                 placeholder="donors = https://yourorg.org/give\nvolunteers = https://yourorg.org/shifts")
+    output = st.radio("Output", list(PERSONALIZED_OUTPUTS), horizontal=True, key="personalize_output")
+    if st.button("👥 Build Personalized Copies", disabled=recipients is None):
+        fmt, extension, mime = PERSONALIZED_OUTPUTS[output]
+        try:
+            links = parse_segment_links(line for line in segment_links.splitlines() if line.strip())
+            reader = read_recipients(io.StringIO(recipients.getvalue().decode('utf-8-sig'), newline=''))
+            rows = list(islice(reader, PERSONALIZE_MAX_RECIPIENTS + 1))
+        except (ValueError, UnicodeDecodeError) as e:
+            st.error(f"Couldn't read the recipients: {e}")
+        else:
+            if len(rows) > PERSONALIZE_MAX_RECIPIENTS:
+                st.error(f"This list has more than {PERSONALIZE_MAX_RECIPIENTS:,} recipients, too many to build here. "
+                         f"Download the newsletter data below and run personalize.py on it (see the README).")
+            else:
+                try:
+                    personalizer = Personalizer(doc, st.session_state.subj1, segment_links=links,
+                                                unsubscribe_url=unsubscribe_url, columns=recipient_columns(reader))
+                except ValueError as e:
+                    personalizer = None
+                    st.error(str(e))
+                if personalizer is not None:
+                    with tempfile.TemporaryDirectory() as tmp:
+                        path = os.path.join(tmp, f"personalized.{extension}")
+                        sink = open_sink(path, compress=fmt == 'html')
+                        try:
+                            summary = personalize(personalizer, rows, sink, fmt)
+                        finally:
+                            sink.close()
+                        with open(path, 'rb') as f:
+                            data = f.read()
+                    st.session_state.personalized = {'data': data, 'name': f"{file_stem}_personalized.{extension}",
+                                                     'mime': mime, 'summary': summary, 'hash': content_hash(doc)}
+    personalized = st.session_state.get('personalized')
+    # Only offered while the newsletter is still the one they were built from
+    if personalized and personalized['hash'] == content_hash(doc):
+        summary = personalized['summary']
+        st.caption(f"✅ {summary['recipients']:,} copies in {summary['wall_s']:.1f}s "
+                   f"({format_bytes(len(personalized['data']))})")
+        st.download_button("📥 Download Personalized Copies", personalized['data'], personalized['name'],
+                           personalized['mime'], use_container_width=True)
+    st.download_button("🧩 Download Newsletter Data (.json)", newsletter_to_json(doc), f"{file_stem}.json",
+                       "application/json", help="For personalize.py, to personalize large lists from the command line")
+
+# Edits are batched in a form, so typing never reruns the script. Submitting
+# reruns only this fragment; the whole page (preview, downloads) is redrawn
+# only if the submitted edits changed the newsletter's content hash.
+@st.fragment
+def edit_section(api_key):
+    if content_hash(newsletter_from_state(st.session_state)) != st.session_state.exports['hash']:
+        st.rerun()
     
-    logo_html = f'<img src="{org_logo}" alt="{org_name}" style="max-height: 50px; margin-bottom: 10px;">' if org_logo else ''
+    st.subheader("✏️ Edit Content")
+    st.caption("Make changes below, then click 'Update Preview' to see them.")
     
-    return f"""<!DOCTYPE html>
-<html>
-<head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"></head>
-<body style="margin: 0; padding: 0; background-color: #f5f5f5; font-family: Georgia, 'Times New Roman', serif;">
-<table width="100%" cellpadding="0" cellspacing="0" style="background-color: #f5f5f5; padding: 20px 0;">
-<tr><td align="center">
-<table width="600" cellpadding="0" cellspacing="0" style="background-color: #ffffff; border-radius: 12px; overflow: hidden; box-shadow: 0 4px 15px rgba(0,0,0,0.08);">
-
-<!-- Header -->
-<tr>
-<td style="background-color: {primary}; padding: 35px 40px; text-align: center;">
-{logo_html}
-<h1 style="color: #ffffff; margin: 0; font-size: 26px; font-weight: 700; letter-spacing: 0.5px;">{org_name.upper() if org_name else 'YOUR ORGANIZATION'}</h1>
-<p style="color: {accent}; margin: 8px 0 0 0; font-size: 13px; letter-spacing: 2px;">{org_tagline if org_tagline else ''}</p>
-</td>
-</tr>
-
-<!-- Opening Hook -->
-<tr>
-<td style="padding: 35px 40px 25px 40px;">
-<p style="font-size: 17px; line-height: 1.75; color: {text_color}; margin: 0;">{hook}</p>
-</td>
-</tr>
-
-<!-- One Main Thing -->
-<tr>
-<td style="padding: 10px 40px 25px 40px;">
-<table width="100%" cellpadding="0" cellspacing="0">
-<tr>
-<td style="background-color: #fffbf0; border-left: 4px solid {accent}; padding: 22px 25px; border-radius: 0 8px 8px 0;">
-<p style="color: {accent}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 10px 0;">✨ The One Thing</p>
-<p style="font-size: 15px; line-height: 1.65; color: {text_color}; margin: 0;">{main_thing}</p>
-</td>
-</tr>
-</table>
-</td>
-</tr>
-
-<!-- CEO Note -->
-<tr>
-<td style="padding: 10px 40px 25px 40px;">
-<table width="100%" cellpadding="0" cellspacing="0">
-<tr>
-<td style="background-color: #f8f9fa; border-radius: 8px; padding: 25px;">
-<p style="color: {primary}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 12px 0;">A Note From Our Team</p>
-<p style="font-size: 15px; line-height: 1.7; color: {text_color}; margin: 0; font-style: italic;">{ceo_note}</p>
-</td>
-</tr>
-</table>
-</td>
-</tr>
-
-<!-- Section Label -->
-<tr>
-<td style="padding: 15px 40px 5px 40px;">
-<p style="color: {primary}; font-size: 16px; font-weight: 700; text-align: center; margin: 0;">— {section_label} —</p>
-</td>
-</tr>
-
-<!-- Pillar 1 -->
-<tr>
-<td style="padding: 20px 40px 15px 40px;">
-{get_image_html(p1_img, p1_name)}
-<table width="100%" cellpadding="0" cellspacing="0">
-<tr>
-<td style="border-bottom: 2px solid {secondary}; padding-bottom: 18px;">
-<p style="color: {secondary}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 6px 0;">{p1_name}</p>
-<p style="color: {primary}; font-size: 16px; font-weight: 700; margin: 0 0 8px 0;">{p1_title}</p>
-<p style="font-size: 14px; line-height: 1.65; color: {text_color}; margin: 0;">{p1_content}</p>
-</td>
-</tr>
-</table>
-</td>
-</tr>
-
-<!-- Pillar 2 -->
-<tr>
-<td style="padding: 20px 40px 15px 40px;">
-{get_image_html(p2_img, p2_name)}
-<table width="100%" cellpadding="0" cellspacing="0">
-<tr>
-<td style="border-bottom: 2px solid {accent}; padding-bottom: 18px;">
-<p style="color: {accent}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 6px 0;">{p2_name}</p>
-<p style="color: {primary}; font-size: 16px; font-weight: 700; margin: 0 0 8px 0;">{p2_title}</p>
-<p style="font-size: 14px; line-height: 1.65; color: {text_color}; margin: 0;">{p2_content}</p>
-</td>
-</tr>
-</table>
-</td>
-</tr>
-
-<!-- Pillar 3 -->
-<tr>
-<td style="padding: 20px 40px 15px 40px;">
-{get_image_html(p3_img, p3_name)}
-<table width="100%" cellpadding="0" cellspacing="0">
-<tr>
-<td style="padding-bottom: 18px;">
-<p style="color: {primary}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 6px 0;">{p3_name}</p>
-<p style="color: {primary}; font-size: 16px; font-weight: 700; margin: 0 0 8px 0;">{p3_title}</p>
-<p style="font-size: 14px; line-height: 1.65; color: {text_color}; margin: 0;">{p3_content}</p>
-</td>
-</tr>
-</table>
-</td>
-</tr>
-
-<!-- CTA Button -->
-<tr>
-<td style="padding: 25px 40px 30px 40px; text-align: center;">
-<a href="{cta_link or '#'}" style="display: inline-block; background-color: {accent}; color: {primary}; font-size: 15px; font-weight: 700; text-decoration: none; padding: 16px 45px; border-radius: 6px; letter-spacing: 0.5px;">{cta_btn}</a>
-</td>
-</tr>
-
-<!-- PS Section -->
-<tr>
-<td style="padding: 20px 40px 30px 40px; border-top: 1px solid #eee;">
-<p style="font-size: 14px; line-height: 1.6; color: #7C7C7C; margin: 0;"><strong>P.S.</strong> {ps}</p>
-</td>
-</tr>
-
-<!-- Footer -->
-<tr>
-<td style="background-color: {primary}; padding: 25px 40px; text-align: center;">
-<p style="color: #ffffff; font-size: 12px; margin: 0 0 8px 0;">{org_name} {('| ' + org_website) if org_website else ''}</p>
-<p style="color: #aaa; font-size: 11px; margin: 0;">
-<a href="#" style="color: {secondary}; text-decoration: none;">Unsubscribe</a> · 
-<a href="#" style="color: {secondary}; text-decoration: none;">View in browser</a>
-</p>
-</td>
-</tr>
-
-</table>
-</td></tr>
-</table>
-</body>
-</html>"""
+    if 'rewrite_error' in st.session_state:
+        st.error(st.session_state.pop('rewrite_error'))
+    if 'rewrite_notice' in st.session_state:
+        st.success(st.session_state.pop('rewrite_notice'))
+    
+    with st.form("edit_form", border=False):
+        st.markdown("**Subject Lines**")
+        st.text_input("Option 1", value=st.session_state.subj1, key="ed_s1")
+        st.text_input("Option 2", value=st.session_state.subj2, key="ed_s2")
+        st.text_input("Option 3", value=st.session_state.subj3, key="ed_s3")
+        
+        col1, col2 = st.columns([5, 1])
+        col1.markdown("**Opening Hook**")
+        with col2:
+            rewrite_button('hook', api_key)
+        st.text_area("Grabs reader attention", value=st.session_state.hook, height=100, key="ed_hook")
+        
+        col1, col2 = st.columns([5, 1])
+        col1.markdown("**The One Thing**")
+        with col2:
+            rewrite_button('main_thing', api_key)
+        st.text_area("Key takeaway", value=st.session_state.main_thing, height=100, key="ed_main")
+        
+        col1, col2 = st.columns([5, 1])
+        col1.markdown("**Team Note**")
+        with col2:
+            rewrite_button('ceo_note', api_key)
+        st.text_area("Personal message", value=st.session_state.ceo_note, height=120, key="ed_ceo")
+        
+        st.markdown("**Content Sections**")
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            st.markdown(f"**{st.session_state.p1_name}**")
+            st.text_input("Title", value=st.session_state.p1_title, key="ed_p1t")
+            st.text_area("Content", value=st.session_state.p1_content, height=100, key="ed_p1c")
+            rewrite_button('pillar1', api_key)
+        
+        with col2:
+            st.markdown(f"**{st.session_state.p2_name}**")
+            st.text_input("Title", value=st.session_state.p2_title, key="ed_p2t")
+            st.text_area("Content", value=st.session_state.p2_content, height=100, key="ed_p2c")
+            rewrite_button('pillar2', api_key)
+        
+        with col3:
+            st.markdown(f"**{st.session_state.p3_name}**")
+            st.text_input("Title", value=st.session_state.p3_title, key="ed_p3t")
+            st.text_area("Content", value=st.session_state.p3_content, height=100, key="ed_p3c")
+            rewrite_button('pillar3', api_key)
+        
+        col1, col2 = st.columns([5, 1])
+        col1.markdown("**Call to Action**")
+        with col2:
+            rewrite_button('cta', api_key)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.text_input("Button text", value=st.session_state.cta_btn, key="ed_cta")
+        with col2:
+            st.text_input("Button link", value=st.session_state.cta_link, key="ed_link")
+        
+        col1, col2 = st.columns([5, 1])
+        col1.markdown("**P.S.**")
+        with col2:
+            rewrite_button('ps', api_key)
+        st.text_area("Closing message", value=st.session_state.ps, height=80, key="ed_ps")
+        
+        st.form_submit_button("🔄 Update Preview", type="primary", use_container_width=True, on_click=apply_edits)
+
+# Everything besides the written fields that the preview and rewrites need,
+# saved with each job so another session can pick it up
+JOB_STATE_KEYS = [
+    'org_name', 'org_tagline', 'org_website', 'org_logo',
+    'primary', 'secondary', 'accent', 'text_color', 'section_label',
+    'p1_name', 'p2_name', 'p3_name', 'cta_link',
+    'p1_image', 'p2_image', 'p3_image', 'p1_img', 'p2_img', 'p3_img', 'prompt_args',
+]
+
+# Saved to the archive with each issue, so it can be opened again later
+ARCHIVE_KEYS = [key for key in JOB_STATE_KEYS if key not in ('p1_image', 'p2_image', 'p3_image')] + ['research_notes']
+
+# Every new or edited issue is saved; edits update the issue they came from
+def archive_issue(content_key, html):
+    if 'prompt_args' not in st.session_state:
+        return
+    fields = {label: st.session_state[field] for label, field in FIELDS}
+    inputs = {key: st.session_state.get(key) for key in ARCHIVE_KEYS}
+    st.session_state.archive_id = archive.save(st.session_state.get('archive_id'), content_key,
+                                               st.session_state.org_name, st.session_state.prompt_args[1],
+                                               fields, inputs, html)
+
+# Button callback: puts an archived issue back in edit mode, no API call needed
+def open_issue(issue_id):
+    issue = archive.load(issue_id)
+    if issue is None:
+        return
+    forget_job()
+    st.session_state.update(issue['inputs'])
+    st.session_state.prompt_args = tuple(issue['inputs']['prompt_args'])
+    for n in (1, 2, 3):
+        # The prepared uploads aren't kept, only the image as it sits in the email
+        st.session_state[f'p{n}_image'] = None
+    for label, field in FIELDS:
+        st.session_state[field] = issue['fields'].get(label, '')
+    for key in EDIT_KEYS.values():
+        st.session_state.pop(key, None)
+    for key in ('last_generation', 'exports', 'personalized', 'image_warnings'):
+        st.session_state.pop(key, None)
+    st.session_state.archive_id = issue_id
+    st.session_state.preview_generated = True
+
+def use_example(issue_id):
+    issue = archive.load(issue_id)
+    if issue is not None:
+        st.session_state.example_issue = {'title': f"{issue['org_name']} — {issue['theme']}", 'fields': issue['fields']}
+
+def show_archive():
+    query = st.text_input("Search past issues", key="archive_query", placeholder="e.g. volunteer drive")
+    issues = archive.search(query, limit=8)
+    if not issues:
+        st.caption("No matching issues." if query.strip() else "Generated issues will show up here.")
+    for issue in issues:
+        updated = datetime.fromtimestamp(issue['updated']).strftime('%b %d, %Y')
+        st.markdown(f"**{issue['org_name']}** — {issue['theme']}  \n:gray[{updated}]"
+                    + (f"  \n:gray[{issue['snippet']}]" if issue['snippet'] else ""))
+        c1, c2 = st.columns(2)
+        c1.button("✏️ Open", key=f"archive_open_{issue['id']}", on_click=open_issue, args=(issue['id'],),
+                  use_container_width=True)
+        c2.button("🧭 Example", key=f"archive_example_{issue['id']}", on_click=use_example, args=(issue['id'],),
+                  use_container_width=True, help="Have the next generation follow this issue's voice")
+    if 'example_issue' in st.session_state:
+        st.caption(f"🧭 New issues follow the voice of {st.session_state.example_issue['title']}")
+        st.button("Stop using the example", on_click=lambda: st.session_state.pop('example_issue', None))
+
+# Builds the job's work function. It runs on a worker thread, so it can't
+# touch st.*; fields go to the job as they're written and the UI polls them.
+def generation_work(api_key, generation_mode, prompt_args, cache, trace, state, use_research=False, example=None):
+    length_instruction = prompt_args[-1]
+
+    def work(on_field):
+        try:
+            notes, research_stats = '', None
+            if use_research:
+                state['stage'] = 'research'
+                # Theme and pillar topics, searched at once within a fixed time budget
+                with trace.span('research'):
+                    notes, research_stats = research(research_queries(prompt_args[1], *prompt_args[5:11]),
+                                                     research_backend, research_cache)
+                trace.set(research=research_stats)
+            state['research_notes'] = notes
+            state['stage'] = 'writing'
+            if generation_mode == "Parallel sections":
+                with trace.span('prompt'):
+                    section_prompts = {name: (labels, build_prompt(*prompt_args, labels=labels, research=notes,
+                                                                       example=example),
+                                              max_tokens_for(labels, length_instruction))
+                                       for name, labels in SECTIONS.items()}
+                async_client = client_manager.async_client(api_key)
+                parsed, metrics = client_manager.run(
+                    lambda callback: generate_sections(async_client, section_prompts, callback, cache=cache,
+                                                       trace=trace),
+                    on_field)
+            else:
+                client = client_manager.client(api_key)
+                with trace.span('prompt'):
+                    prompt = build_prompt(*prompt_args, research=notes, example=example)
+                max_tokens = max_tokens_for(length_instruction=length_instruction)
+
+                # Anything the response leaves out is asked for again on its own
+                def prompt_for(labels):
+                    return build_prompt(*prompt_args, labels=labels, research=notes, example=example)
+
+                if generation_mode == "Streaming":
+                    parsed, metrics = stream_newsletter(client, prompt, on_field, max_tokens, cache=cache,
+                                                        prompt_for=prompt_for, trace=trace)
+                elif generation_mode == "Structured output":
+                    parsed, metrics = generate_structured(client, prompt, structured_tool, max_tokens,
+                                                          cache=cache, prompt_for=prompt_for, trace=trace)
+                else:
+                    parsed, metrics = generate_newsletter(client, prompt, max_tokens, cache=cache,
+                                                          prompt_for=prompt_for, trace=trace)
+            trace.set(usage=metrics['usage'], cached=metrics['cached'])
+            metrics['research'] = research_stats
+            return parsed, metrics
+        finally:
+            # Handed to whichever session picks the job up
+            state['trace_record'] = tracer.finish(trace)
+
+    return work
+
+def forget_job():
+    st.session_state.pop('job_id', None)
+    st.query_params.pop('job', None)
+
+# Moves a finished job's result into this session
+def pick_up_job(job):
+    keep_trace(job.state.get('trace_record'))
+    if job.status == 'failed':
+        if is_auth_error(job.error):
+            st.session_state.job_error = "Invalid API key. Please check your Anthropic API key."
+        elif isinstance(job.error, SectionError):
+            st.session_state.job_error = f"Error: {str(job.error)}. Please try again."
+        else:
+            st.session_state.job_error = f"Error: {str(job.error)}"
+        forget_job()
+        return
+    parsed, metrics = job.result
+    for label, field in FIELDS:
+        st.session_state[field] = parsed.get(label, '')
+    st.session_state.last_generation = metrics
+    # Rewrites see the same research as the first draft
+    st.session_state.research_notes = job.state.get('research_notes', '')
+    st.session_state.preview_generated = True
+
+@st.fragment(run_every=1.0)
+def job_progress():
+    job = job_queue.get(st.session_state.job_id)
+    if job is None:
+        forget_job()
+        st.warning("That generation is no longer available. Please generate again.")
+        return
+    if job.done:
+        pick_up_job(job)
+        st.rerun()
+    if job.status == 'queued':
+        ahead = job_queue.position(job)
+        st.info("⏳ Waiting for a free writer" + (f" ({ahead} ahead of you on this API key)" if ahead else "") + "...")
+        return
+    fields = job.fields()
+    if not fields:
+        if job.state.get('stage') == 'research':
+            st.info("🔎 Researching your topics...")
+        else:
+            st.info("✨ Writing your newsletter...")
+        return
+    for label, value in fields.items():
+        st.session_state[STATE_KEYS[label]] = value
+    st.caption(f"✍️ Written {len(fields)} of {len(FIELDS)} fields, "
+               f"latest {list(fields)[-1].replace('_', ' ').lower()}...")
+    st.components.v1.html(session_html(), height=1400, scrolling=True)
+
+# A fresh session (e.g. after a reload) picks up the job named in the URL
+if 'job_id' not in st.session_state and 'job' in st.query_params:
+    job = job_queue.get(st.query_params['job'])
+    if job is None:
+        st.query_params.pop('job', None)
+    else:
+        st.session_state.update({key: value for key, value in job.state.items() if key in JOB_STATE_KEYS})
+        st.session_state.job_id = job.id
+        if job.done:
+            pick_up_job(job)
 
 # ============ SIDEBAR ============
 with st.sidebar:
     st.header("⚙️ Settings")
     api_key = st.text_input("Anthropic API Key", type="password")
+    generation_mode = st.radio("Generation mode", ["Streaming", "Parallel sections", "Single request", "Structured output"],
+                               help="Streaming shows each section as soon as it's written. Parallel sections writes "
+                                    "the header, each pillar and the closing at the same time. Structured output "
+                                    "has Claude fill in a JSON schema instead of labelled text.")
+    bypass_cache = st.checkbox("Bypass cache (regenerate)",
+                               help="Always ask Claude for fresh copy, even if these exact inputs were generated before.")
+    use_research = st.checkbox("🔎 Research topics on the web",
+                               help="Search the web for the theme and each section's topic first, and give Claude "
+                                    "the best snippets to work from. Adds a few seconds; searches are cached for a day.")
+    cache_stats = generation_cache.stats()
+    st.caption(f"💾 Cache: {cache_stats['hits']} hits · {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+    api_stats = client_manager.metrics()
+    st.caption(f"🔌 API: {api_stats['requests']} requests · {api_stats['retries']} retries "
+               f"({api_stats['retry_wait_s']:.1f}s backing off) · {api_stats['queue_wait_s']:.1f}s queued for rate limit")
+    job_stats = job_queue.metrics()
+    st.caption(f"🧵 Jobs: {job_stats['running']} running · {job_stats['queued']} queued "
+               f"({job_stats['workers']} workers, {job_stats['per_key']} per key) · "
+               f"{job_stats['avg_queue_wait_s']:.1f}s average wait")
+    # Filled in at the end of the script, once this run's traces are done
+    perf_panel = st.expander("📊 Performance")
+    with perf_panel:
+        st.toggle("Record traces", value=tracer.enabled, key="trace_enabled",
+                  help=f"Time each phase of generating and rendering, and append it to {tracer.path}")
+    with st.expander(f"🗄️ Archive ({archive.count():,} issues)"):
+        show_archive()
+    with st.expander("📏 Email size"):
+        st.number_input("Warn above (KB)", min_value=1, value=WARN_BYTES // 1024, key="size_warn_kb")
+        st.number_input("Limit (KB)", min_value=1, value=GMAIL_CLIP_BYTES // 1024, key="size_limit_kb",
+                        help="Gmail clips emails whose HTML is over about 102 KB")
+        st.text_input("Image host URL", key="size_image_base_url", placeholder="https://yourorg.org/news/images/",
+                      help="Where you'll upload the images. Without one, every image stays inline in the HTML.")
+        st.number_input("Inline images up to (KB)", min_value=0, value=INLINE_IMAGE_BYTES // 1024, key="size_inline_kb",
+                        help="With an image host URL, bigger images are moved out of the downloaded HTML and "
+                             "linked from the host")
+        st.radio("Over the limit", ["Warn", "Block the download"], key="size_action", horizontal=True)
+        st.checkbox("Share repeated styles in a <style> block", key="size_style_classes",
+                    help="Smaller HTML. Gmail, Apple Mail and Outlook support it; some other clients show the "
+                         "email unstyled.")
     
     st.divider()
     st.header("🏢 Organization")
@@ -201,11 +682,11 @@ with st.sidebar:
     st.header("🎨 Brand Colors")
     c1, c2 = st.columns(2)
     with c1:
-        primary_color = st.color_picker("Primary", "#2C3E50")
-        accent_color = st.color_picker("Accent", "#F7C548")
+        primary_color = st.color_picker("Primary", DEFAULT_PALETTE.primary)
+        accent_color = st.color_picker("Accent", DEFAULT_PALETTE.accent)
     with c2:
-        secondary_color = st.color_picker("Secondary", "#4F9DCB")
-        text_color = st.color_picker("Text", "#2C3E50")
+        secondary_color = st.color_picker("Secondary", DEFAULT_PALETTE.secondary)
+        text_color = st.color_picker("Text", DEFAULT_PALETTE.text_color)
 
 # ============ MAIN FORM ============
 if not st.session_state.preview_generated:
@@ -269,12 +750,13 @@ if not st.session_state.preview_generated:
     
     # Length preference
     length_option = st.radio("Content length", ["Standard (2-3 sentences per section)", "Detailed (4-5 sentences per section)"], horizontal=True)
-    length_instruction = "2-3 sentences" if "Standard" in length_option else "4-5 sentences"
+    length_instruction = length_instruction_for(length_option)
     
     st.divider()
     
     # Generate button
-    if st.button("🚀 Generate Newsletter", type="primary", use_container_width=True):
+    if st.button("🚀 Generate Newsletter", type="primary", use_container_width=True,
+                 disabled='job_id' in st.session_state):
         if not api_key:
             st.error("Please enter your Anthropic API key in the sidebar.")
         elif not theme:
@@ -282,123 +764,64 @@ if not st.session_state.preview_generated:
         elif not org_name:
             st.error("Please enter your organization name in the sidebar.")
         else:
-            with st.spinner("✨ Writing your newsletter..."):
-                try:
-                    prompt = f"""Write a newsletter for {org_name}.
-
-THEME: {theme}
-KEY POINTS FROM LEADERSHIP: {ceo_bullets}
-CALL TO ACTION: {cta_text}
-P.S. TOPIC: {ps_input}
-
-CONTENT SECTIONS:
-1. {pillar1_name}: {pillar1_topic}
-2. {pillar2_name}: {pillar2_topic}
-3. {pillar3_name}: {pillar3_topic}
-
-Return content in this EXACT format (no extra text, just the labels and content):
-
-SUBJECT_LINE_1: [Curiosity-driven, 5-8 words]
-SUBJECT_LINE_2: [Different angle, 5-8 words]
-SUBJECT_LINE_3: [Third option, 5-8 words]
-OPENING_HOOK: [2-3 engaging sentences to open the newsletter]
-ONE_MAIN_THING: [{length_instruction} - the key takeaway]
-CEO_NOTE: [Personal, warm, {length_instruction} in first person voice]
-PILLAR1_TITLE: [Catchy headline for {pillar1_name}]
-PILLAR1_CONTENT: [{length_instruction} about {pillar1_name}]
-PILLAR2_TITLE: [Catchy headline for {pillar2_name}]
-PILLAR2_CONTENT: [{length_instruction} about {pillar2_name}]
-PILLAR3_TITLE: [Catchy headline for {pillar3_name}]
-PILLAR3_CONTENT: [{length_instruction} about {pillar3_name}]
-CTA_BUTTON: [3-5 words for button]
-PS_TEXT: [Engaging P.S. message]
-
-TONE: Warm, direct, empowering. Like a trusted friend sharing what matters."""
-
-                    client = anthropic.Anthropic(api_key=api_key)
-                    message = client.messages.create(
-                        model="claude-sonnet-4-20250514",
-                        max_tokens=2500,
-                        messages=[{"role": "user", "content": prompt}]
-                    )
-                    
-                    # Parse response
-                    content = message.content[0].text
-                    parsed = {}
-                    lines = content.split('\n')
-                    current_key = None
-                    current_val = []
-                    
-                    keys = ['SUBJECT_LINE_1', 'SUBJECT_LINE_2', 'SUBJECT_LINE_3', 'OPENING_HOOK', 
-                            'ONE_MAIN_THING', 'CEO_NOTE', 'PILLAR1_TITLE', 'PILLAR1_CONTENT',
-                            'PILLAR2_TITLE', 'PILLAR2_CONTENT', 'PILLAR3_TITLE', 'PILLAR3_CONTENT',
-                            'CTA_BUTTON', 'PS_TEXT']
-                    
-                    for line in lines:
-                        line = line.strip()
-                        matched = False
-                        for key in keys:
-                            if line.startswith(key + ':'):
-                                if current_key:
-                                    parsed[current_key] = ' '.join(current_val).strip()
-                                current_key = key
-                                current_val = [line.split(':', 1)[1].strip()] if ':' in line else []
-                                matched = True
-                                break
-                        if not matched and current_key:
-                            current_val.append(line)
-                    
-                    if current_key:
-                        parsed[current_key] = ' '.join(current_val).strip()
-                    
-                    # Store in session state
-                    st.session_state.subj1 = parsed.get('SUBJECT_LINE_1', '')
-                    st.session_state.subj2 = parsed.get('SUBJECT_LINE_2', '')
-                    st.session_state.subj3 = parsed.get('SUBJECT_LINE_3', '')
-                    st.session_state.hook = parsed.get('OPENING_HOOK', '')
-                    st.session_state.main_thing = parsed.get('ONE_MAIN_THING', '')
-                    st.session_state.ceo_note = parsed.get('CEO_NOTE', '')
-                    st.session_state.p1_title = parsed.get('PILLAR1_TITLE', '')
-                    st.session_state.p1_content = parsed.get('PILLAR1_CONTENT', '')
-                    st.session_state.p2_title = parsed.get('PILLAR2_TITLE', '')
-                    st.session_state.p2_content = parsed.get('PILLAR2_CONTENT', '')
-                    st.session_state.p3_title = parsed.get('PILLAR3_TITLE', '')
-                    st.session_state.p3_content = parsed.get('PILLAR3_CONTENT', '')
-                    st.session_state.cta_btn = parsed.get('CTA_BUTTON', '')
-                    st.session_state.ps = parsed.get('PS_TEXT', '')
-                    
-                    # Store other inputs
-                    st.session_state.org_name = org_name
-                    st.session_state.org_tagline = org_tagline
-                    st.session_state.org_website = org_website
-                    st.session_state.org_logo = org_logo_url
-                    st.session_state.primary = primary_color
-                    st.session_state.secondary = secondary_color
-                    st.session_state.accent = accent_color
-                    st.session_state.text_color = text_color
-                    st.session_state.section_label = section_label
-                    st.session_state.p1_name = pillar1_name
-                    st.session_state.p2_name = pillar2_name
-                    st.session_state.p3_name = pillar3_name
-                    st.session_state.cta_link = cta_link
-                    st.session_state.p1_img = get_image_src(pillar1_upload, pillar1_url)
-                    st.session_state.p2_img = get_image_src(pillar2_upload, pillar2_url)
-                    st.session_state.p3_img = get_image_src(pillar3_upload, pillar3_url)
-                    
-                    st.session_state.preview_generated = True
-                    st.rerun()
-                    
-                except anthropic.AuthenticationError:
-                    st.error("Invalid API key. Please check your Anthropic API key.")
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
+            # Store other inputs first so the preview can fill in while the model writes
+            for _, field in FIELDS:
+                st.session_state[field] = ""
+            st.session_state.org_name = org_name
+            st.session_state.org_tagline = org_tagline
+            st.session_state.org_website = org_website
+            st.session_state.org_logo = org_logo_url
+            st.session_state.primary = primary_color
+            st.session_state.secondary = secondary_color
+            st.session_state.accent = accent_color
+            st.session_state.text_color = text_color
+            st.session_state.section_label = section_label
+            st.session_state.p1_name = pillar1_name
+            st.session_state.p2_name = pillar2_name
+            st.session_state.p3_name = pillar3_name
+            st.session_state.cta_link = cta_link
+            trace = start_trace('generate', mode=generation_mode)
+            st.session_state.image_warnings = []
+            with trace.span('image_encoding'):
+                st.session_state.p1_image = get_image(pillar1_upload)
+                st.session_state.p2_image = get_image(pillar2_upload)
+                st.session_state.p3_image = get_image(pillar3_upload)
+                st.session_state.p1_img = get_image_src(st.session_state.p1_image, pillar1_url)
+                st.session_state.p2_img = get_image_src(st.session_state.p2_image, pillar2_url)
+                st.session_state.p3_img = get_image_src(st.session_state.p3_image, pillar3_url)
+
+            st.session_state.prompt_args = (org_name, theme, ceo_bullets, cta_text, ps_input,
+                                            pillar1_name, pillar1_topic, pillar2_name, pillar2_topic,
+                                            pillar3_name, pillar3_topic, length_instruction)
+            cache = generation_cache.bypass() if bypass_cache else generation_cache
+            state = {key: st.session_state[key] for key in JOB_STATE_KEYS}
+            example = st.session_state.get('example_issue', {}).get('fields')
+            work = generation_work(api_key, generation_mode, st.session_state.prompt_args, cache, trace, state,
+                                   use_research, example)
+            # A new issue in the archive, not an edit of the last one
+            st.session_state.pop('archive_id', None)
+            job = job_queue.submit(api_key, work, state)
+            # Kept in the URL too, so reloading the page picks the job back up
+            st.session_state.job_id = job.id
+            st.query_params['job'] = job.id
+            st.rerun()
+
+    if 'job_error' in st.session_state:
+        st.error(st.session_state.pop('job_error'))
+    show_image_warnings()
+    if 'job_id' in st.session_state:
+        job_progress()
 
 # ============ PREVIEW + EDIT MODE ============
 else:
     # Start over button
     if st.button("← Start Over"):
         st.session_state.preview_generated = False
+        st.session_state.pop('archive_id', None)
+        st.session_state.pop('image_warnings', None)
+        forget_job()
         st.rerun()
+    show_image_warnings()
     
     # Subject lines
     st.subheader("📧 Subject Line Options")
@@ -408,82 +831,48 @@ else:
     
     st.divider()
     
-    # Build and show preview
-    html = build_html(
-        st.session_state.org_name, st.session_state.org_tagline, 
-        st.session_state.org_website, st.session_state.org_logo,
-        st.session_state.primary, st.session_state.secondary, 
-        st.session_state.accent, st.session_state.text_color,
-        st.session_state.section_label,
-        st.session_state.hook, st.session_state.main_thing, st.session_state.ceo_note,
-        st.session_state.p1_name, st.session_state.p1_title, st.session_state.p1_content, st.session_state.p1_img,
-        st.session_state.p2_name, st.session_state.p2_title, st.session_state.p2_content, st.session_state.p2_img,
-        st.session_state.p3_name, st.session_state.p3_title, st.session_state.p3_content, st.session_state.p3_img,
-        st.session_state.cta_btn, st.session_state.cta_link, st.session_state.ps
-    )
+    # Rendered output is only rebuilt when the newsletter itself changed
+    exports = session_exports()
     
     st.subheader("👀 Preview")
-    st.components.v1.html(html, height=1400, scrolling=True)
+    if 'last_generation' in st.session_state:
+        metrics = st.session_state.last_generation
+        source = "from cache" if metrics.get('cached') else metrics['mode']
+        st.caption(f"⏱️ First content in {metrics['first_content_s']:.1f}s · full newsletter in {metrics['total_s']:.1f}s ({source})")
+        if metrics.get('refilled'):
+            st.caption(f"🔁 Re-requested {len(metrics['refilled'])} field(s) the first response left out: "
+                       f"{', '.join(metrics['refilled'])}")
+        research_stats = metrics.get('research')
+        if research_stats:
+            st.caption(f"🔎 Research: {research_stats['snippets']} snippets from {research_stats['queries']} searches "
+                       f"({research_stats['cached']} cached, {research_stats['timed_out']} timed out) "
+                       f"in {research_stats['time_s']:.1f}s")
+        usage = metrics.get('usage')
+        if usage and not metrics.get('cached'):
+            st.caption(f"🧮 Tokens: {usage['input_tokens']:,} input · {usage['cache_read_input_tokens']:,} read from "
+                       f"prompt cache · {usage['cache_creation_input_tokens']:,} written to prompt cache · "
+                       f"{usage['output_tokens']:,} output")
+    show_size_report(exports['optimized'])
+    st.components.v1.html(exports['html'], height=1400, scrolling=True)
+    
+    images = session_images()
+    for n, image in images:
+        note = f" · {image.note}" if image.note else ""
+        dims = f" ({image.width}×{image.height})" if image.width else ""
+        st.caption(f"🖼️ {st.session_state[f'p{n}_name']} image: {format_bytes(image.original_size)} uploaded → "
+                   f"{format_bytes(image.size)} in the email{dims}{note}")
     
     # Download buttons
     st.divider()
-    col1, col2 = st.columns(2)
-    with col1:
-        st.download_button("📥 Download HTML", html, f"newsletter_{datetime.now().strftime('%Y%m%d')}.html", "text/html", use_container_width=True)
-    with col2:
-        plain = f"""SUBJECT OPTIONS:\n1. {st.session_state.subj1}\n2. {st.session_state.subj2}\n3. {st.session_state.subj3}\n\n{st.session_state.hook}\n\nTHE ONE THING:\n{st.session_state.main_thing}\n\nFROM OUR TEAM:\n{st.session_state.ceo_note}\n\n{st.session_state.p1_name}: {st.session_state.p1_title}\n{st.session_state.p1_content}\n\n{st.session_state.p2_name}: {st.session_state.p2_title}\n{st.session_state.p2_content}\n\n{st.session_state.p3_name}: {st.session_state.p3_title}\n{st.session_state.p3_content}\n\n{st.session_state.cta_btn}: {st.session_state.cta_link}\n\nP.S. {st.session_state.ps}"""
-        st.download_button("📄 Download Text", plain, f"newsletter_{datetime.now().strftime('%Y%m%d')}.txt", "text/plain", use_container_width=True)
+    download_section()
+    with st.expander("👥 Personalize for a mailing list"):
+        personalize_section()
     
     st.divider()
-    
-    # Editable sections
-    st.subheader("✏️ Edit Content")
-    st.caption("Make changes below, then click 'Update Preview' to see them.")
-    
-    st.markdown("**Subject Lines**")
-    st.session_state.subj1 = st.text_input("Option 1", value=st.session_state.subj1, key="ed_s1")
-    st.session_state.subj2 = st.text_input("Option 2", value=st.session_state.subj2, key="ed_s2")
-    st.session_state.subj3 = st.text_input("Option 3", value=st.session_state.subj3, key="ed_s3")
-    
-    st.markdown("**Opening Hook**")
-    st.session_state.hook = st.text_area("Grabs reader attention", value=st.session_state.hook, height=100, key="ed_hook")
-    
-    st.markdown("**The One Thing**")
-    st.session_state.main_thing = st.text_area("Key takeaway", value=st.session_state.main_thing, height=100, key="ed_main")
-    
-    st.markdown("**Team Note**")
-    st.session_state.ceo_note = st.text_area("Personal message", value=st.session_state.ceo_note, height=120, key="ed_ceo")
-    
-    st.markdown("**Content Sections**")
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        st.markdown(f"**{st.session_state.p1_name}**")
-        st.session_state.p1_title = st.text_input("Title", value=st.session_state.p1_title, key="ed_p1t")
-        st.session_state.p1_content = st.text_area("Content", value=st.session_state.p1_content, height=100, key="ed_p1c")
-    
-    with col2:
-        st.markdown(f"**{st.session_state.p2_name}**")
-        st.session_state.p2_title = st.text_input("Title", value=st.session_state.p2_title, key="ed_p2t")
-        st.session_state.p2_content = st.text_area("Content", value=st.session_state.p2_content, height=100, key="ed_p2c")
-    
-    with col3:
-        st.markdown(f"**{st.session_state.p3_name}**")
-        st.session_state.p3_title = st.text_input("Title", value=st.session_state.p3_title, key="ed_p3t")
-        st.session_state.p3_content = st.text_area("Content", value=st.session_state.p3_content, height=100, key="ed_p3c")
-    
-    st.markdown("**Call to Action**")
-    col1, col2 = st.columns(2)
-    with col1:
-        st.session_state.cta_btn = st.text_input("Button text", value=st.session_state.cta_btn, key="ed_cta")
-    with col2:
-        st.session_state.cta_link = st.text_input("Button link", value=st.session_state.cta_link, key="ed_link")
-    
-    st.markdown("**P.S.**")
-    st.session_state.ps = st.text_area("Closing message", value=st.session_state.ps, height=80, key="ed_ps")
-    
-    if st.button("🔄 Update Preview", type="primary", use_container_width=True):
-        st.rerun()
+    edit_section(api_key)
+
+with perf_panel:
+    show_traces()
 
 # Footer
 st.divider()
@@ -0,0 +1,124 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+ARCHIVE_PATH = os.path.join(".newsie_archive", "issues.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    content_hash TEXT NOT NULL,
+    org_name TEXT NOT NULL,
+    theme TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    html TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS issues_updated ON issues (updated);
+CREATE INDEX IF NOT EXISTS issues_content_hash ON issues (content_hash);
+CREATE VIRTUAL TABLE IF NOT EXISTS issue_text USING fts5(org_name, theme, body, prefix='2 3', tokenize='porter unicode61');
+"""
+
+# Listing and search read only these; the fields, inputs and HTML are
+# loaded one issue at a time
+SUMMARY_COLUMNS = "issues.id, issues.org_name, issues.theme, issues.created, issues.updated"
+
+
+# "spring vol" -> "spring"* "vol"*: every word must match, as a prefix, and
+# nothing the user types is read as FTS5 query syntax
+def match_query(query):
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', query.lower()))
+
+
+# Every generated or edited issue, kept across restarts: the written fields
+# (by label), the inputs and brand settings needed to edit it again, and the
+# rendered HTML. The text is indexed with FTS5 and listings never read the
+# large columns, so searching and loading stay fast as the archive grows.
+class Archive:
+    def __init__(self, path=ARCHIVE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    # Updates issue_id if given. Otherwise an issue with exactly this content
+    # is updated rather than stored twice (e.g. a job picked up again after a
+    # reload). Returns the issue's id.
+    def save(self, issue_id, content_hash, org_name, theme, fields, inputs, html):
+        now = time.time()
+        body = '\n'.join(value for value in fields.values() if value)
+        values = (content_hash, org_name, theme, json.dumps(fields), json.dumps(inputs), html)
+        with self._lock, self._conn:
+            if issue_id is None:
+                row = self._conn.execute("SELECT id FROM issues WHERE content_hash = ?", (content_hash,)).fetchone()
+                issue_id = row['id'] if row else None
+            if issue_id is not None and self._conn.execute(
+                    "UPDATE issues SET updated = ?, content_hash = ?, org_name = ?, theme = ?, fields = ?, inputs = ?, "
+                    "html = ? WHERE id = ?", (now, *values, issue_id)).rowcount:
+                self._conn.execute("DELETE FROM issue_text WHERE rowid = ?", (issue_id,))
+            else:
+                issue_id = self._conn.execute(
+                    "INSERT INTO issues (created, updated, content_hash, org_name, theme, fields, inputs, html) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (now, now, *values)).lastrowid
+            self._conn.execute("INSERT INTO issue_text (rowid, org_name, theme, body) VALUES (?, ?, ?, ?)",
+                               (issue_id, org_name, theme, body))
+        return issue_id
+
+    def recent(self, limit=10):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {SUMMARY_COLUMNS}, '' AS snippet FROM issues "
+                                      f"ORDER BY updated DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    # Best matches first (newer issues first among equals), each with a
+    # snippet of the text around the match. Every match is ranked; snippets
+    # are only made for the ones returned.
+    def search(self, query, limit=10):
+        match = match_query(query)
+        if not match:
+            return self.recent(limit)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {SUMMARY_COLUMNS} FROM ("
+                f"  SELECT rowid, bm25(issue_text, 5.0, 3.0, 1.0) AS score FROM issue_text"
+                f"  WHERE issue_text MATCH ? ORDER BY score, rowid DESC LIMIT ?"
+                f") AS hits JOIN issues ON issues.id = hits.rowid ORDER BY hits.score, hits.rowid DESC",
+                (match, limit)).fetchall()
+            ids = [row['id'] for row in rows]
+            snippets = dict(self._conn.execute(
+                f"SELECT rowid, snippet(issue_text, 2, '**', '**', '…', 12) FROM issue_text "
+                f"WHERE issue_text MATCH ? AND rowid IN ({', '.join('?' * len(ids))})", (match, *ids)).fetchall())
+        return [{**dict(row), 'snippet': snippets.get(row['id'], '')} for row in rows]
+
+    def load(self, issue_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM issues WHERE id = ?", (issue_id,)).fetchone()
+        if row is None:
+            return None
+        issue = dict(row)
+        issue['fields'] = json.loads(issue['fields'])
+        issue['inputs'] = json.loads(issue['inputs'])
+        return issue
+
+    def delete(self, issue_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM issues WHERE id = ?", (issue_id,))
+            self._conn.execute("DELETE FROM issue_text WHERE rowid = ?", (issue_id,))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM issues").fetchone()[0]
+
+
+# NEWSIE_ARCHIVE moves the archive file
+def default_archive():
+    return Archive(os.environ.get('NEWSIE_ARCHIVE', ARCHIVE_PATH))
@@ -0,0 +1,272 @@
+# Headless newsletter generation from a JSONL or CSV file of specs, one
+# newsletter per row. Column names match the form fields in app.py; anything
+# left out falls back to the same defaults the form uses.
+#
+#     python batch.py chapters.jsonl --out issues.zip --concurrency 4
+#     python batch.py chapters.csv --out issues/ --message-batches
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+import sys
+import time
+
+from cache import default_cache
+from clients import ClientManager
+from generation import (add_usage, cached_response, drop_truncated, fill_missing, fill_missing_async, max_tokens_for,
+                        new_usage, request_params, store_response)
+from parsing import missing_fields, parse_response
+from prompts import LABELS, build_prompt, length_instruction_for
+from render import (DEFAULT_PALETTE, Newsletter, Org, Palette, Pillar, newsletter_to_json, render_newsletter,
+                    render_plain_text)
+from sinks import open_sink
+
+SPEC_DEFAULTS = {
+    'org_name': '', 'org_tagline': '', 'org_website': '', 'org_logo': '',
+    'theme': '', 'ceo_bullets': '', 'cta_text': '', 'cta_link': '', 'ps_input': '',
+    'section_label': "What's New", 'length': 'Standard',
+    'pillar1_name': 'Health', 'pillar1_topic': '', 'pillar1_image': '',
+    'pillar2_name': 'Wealth', 'pillar2_topic': '', 'pillar2_image': '',
+    'pillar3_name': 'Community', 'pillar3_topic': '', 'pillar3_image': '',
+    'primary': DEFAULT_PALETTE.primary, 'secondary': DEFAULT_PALETTE.secondary,
+    'accent': DEFAULT_PALETTE.accent, 'text_color': DEFAULT_PALETTE.text_color,
+}
+
+
+def read_jsonl(f, path):
+    rows = []
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path} line {number}: not valid JSON ({e.msg})") from e
+        if not isinstance(row, dict):
+            raise ValueError(f"{path} line {number}: expected a JSON object")
+        rows.append(row)
+    return rows
+
+
+# Raises ValueError, naming the row, for anything that can't be generated
+def read_specs(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f)) if path.endswith('.csv') else read_jsonl(f, path)
+    specs = []
+    seen = {}
+    for index, row in enumerate(rows, 1):
+        spec = dict(SPEC_DEFAULTS)
+        spec.update({key: value for key, value in row.items() if value not in (None, '')})
+        if not spec['org_name'] or not spec['theme']:
+            raise ValueError(f"{path} row {index}: org_name and theme are required")
+        spec['id'] = (slugify(str(spec.get('id') or f"{index:03d}-{spec['org_name']}-{spec['theme']}"))
+                      or f"{index:03d}")
+        # Output files and batch results are matched up by id
+        if spec['id'] in seen:
+            raise ValueError(f"{path} row {index}: id {spec['id']!r} is already used by row {seen[spec['id']]}")
+        seen[spec['id']] = index
+        specs.append(spec)
+    return specs
+
+
+# Also a valid Message Batches custom_id: [a-zA-Z0-9_-], 64 characters at most
+def slugify(text, max_length=64):
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')[:max_length].rstrip('-')
+
+
+def spec_prompt(spec, labels=LABELS):
+    return build_prompt(spec['org_name'], spec['theme'], spec['ceo_bullets'], spec['cta_text'], spec['ps_input'],
+                        spec['pillar1_name'], spec['pillar1_topic'], spec['pillar2_name'], spec['pillar2_topic'],
+                        spec['pillar3_name'], spec['pillar3_topic'], length_instruction_for(spec['length']),
+                        labels=labels)
+
+
+def spec_max_tokens(spec, labels=LABELS):
+    return max_tokens_for(labels, length_instruction_for(spec['length']))
+
+
+# generation.fill_missing's prompt_for and tokens_for: just the missing
+# labels, at the spec's length
+def spec_refill(spec):
+    return {'prompt_for': lambda labels: spec_prompt(spec, labels),
+            'tokens_for': lambda labels: spec_max_tokens(spec, labels)}
+
+
+def spec_newsletter(spec, parsed):
+    return Newsletter(
+        org=Org(spec['org_name'], spec['org_tagline'], spec['org_website'], spec['org_logo']),
+        palette=Palette(spec['primary'], spec['secondary'], spec['accent'], spec['text_color']),
+        section_label=spec['section_label'],
+        hook=parsed.get('OPENING_HOOK', ''),
+        main_thing=parsed.get('ONE_MAIN_THING', ''),
+        ceo_note=parsed.get('CEO_NOTE', ''),
+        pillars=tuple(
+            Pillar(spec[f'pillar{n}_name'], parsed.get(f'PILLAR{n}_TITLE', ''),
+                   parsed.get(f'PILLAR{n}_CONTENT', ''), spec[f'pillar{n}_image'] or None)
+            for n in (1, 2, 3)
+        ),
+        cta_btn=parsed.get('CTA_BUTTON', ''),
+        cta_link=spec['cta_link'],
+        ps=parsed.get('PS_TEXT', ''),
+        subjects=tuple(parsed.get(f'SUBJECT_LINE_{n}', '') for n in (1, 2, 3)),
+    )
+
+
+def write_issue(sink, spec, parsed):
+    doc = spec_newsletter(spec, parsed)
+    sink.write(f"{spec['id']}.html", render_newsletter(doc))
+    sink.write(f"{spec['id']}.txt", render_plain_text(doc))
+    # For personalize.py
+    sink.write(f"{spec['id']}.json", newsletter_to_json(doc))
+    return missing_fields(parsed)
+
+
+class Progress:
+    def __init__(self, total, out=sys.stderr):
+        self.total = total
+        self.out = out
+        self.done = 0
+        self.failed = 0
+        self.usage = new_usage()
+        self.start = time.perf_counter()
+
+    def record(self, spec, elapsed, usage=None, missing=(), error=None):
+        self.done += 1
+        for field, tokens in (usage or {}).items():
+            self.usage[field] += tokens
+        wall = time.perf_counter() - self.start
+        if error is not None:
+            self.failed += 1
+            status = f"FAILED: {error}"
+        else:
+            status = f"{elapsed:.1f}s" + (f", missing {', '.join(missing)}" if missing else "")
+            if usage:
+                status += (f", {usage['input_tokens']} in / {usage['cache_read_input_tokens']} cached / "
+                           f"{usage['output_tokens']} out tokens")
+        print(f"[{self.done}/{self.total}] {spec['id']} {status} · "
+              f"{self.done / wall * 60:.1f} issues/min · {self.usage['output_tokens'] / wall:.0f} output tok/s",
+              file=self.out)
+
+    def summary(self):
+        wall = time.perf_counter() - self.start
+        return {
+            'issues': self.done - self.failed,
+            'failed': self.failed,
+            'wall_s': wall,
+            'issues_per_min': self.done / wall * 60 if wall else 0.0,
+            'usage': self.usage,
+        }
+
+
+async def generate_batch(async_client, specs, sink, concurrency=4, cache=None, progress=None):
+    progress = progress or Progress(len(specs))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(spec):
+        start = time.perf_counter()
+        prompt = spec_prompt(spec)
+        max_tokens = spec_max_tokens(spec)
+        try:
+            hit = cached_response(cache, prompt, max_tokens)
+            usage = new_usage()
+            if hit is not None:
+                parsed = hit['parsed']
+            else:
+                async with semaphore:
+                    message = await async_client.messages.create(**request_params(prompt, max_tokens))
+                text = message.content[0].text
+                parsed = parse_response(text)
+                add_usage(usage, message.usage)
+                truncated = drop_truncated(parsed, message)
+                if missing_fields(parsed):
+                    async with semaphore:
+                        text += '\n' + await fill_missing_async(async_client, parsed, usage=usage, **spec_refill(spec))
+                if not truncated:
+                    store_response(cache, prompt, max_tokens, text, parsed)
+            missing = write_issue(sink, spec, parsed)
+        except Exception as e:
+            progress.record(spec, time.perf_counter() - start, error=e)
+            return
+        progress.record(spec, time.perf_counter() - start, usage, missing)
+
+    await asyncio.gather(*(run(spec) for spec in specs))
+    return progress.summary()
+
+
+# Message Batches API: half the price, results within 24 hours. Submits every
+# spec as one batch, polls until it ends, then streams the results out.
+# Fields a result left out are asked for again with a regular request, at
+# the regular price, before the issue is written.
+def generate_message_batch(client, specs, sink, poll_interval=30.0, progress=None):
+    progress = progress or Progress(len(specs))
+    by_id = {spec['id']: spec for spec in specs}
+    batch = client.messages.batches.create(requests=[
+        {'custom_id': spec['id'], 'params': request_params(spec_prompt(spec), spec_max_tokens(spec))}
+        for spec in specs
+    ])
+    while batch.processing_status != 'ended':
+        time.sleep(poll_interval)
+        batch = client.messages.batches.retrieve(batch.id)
+
+    start = time.perf_counter()
+    for entry in client.messages.batches.results(batch.id):
+        spec = by_id[entry.custom_id]
+        if entry.result.type != 'succeeded':
+            progress.record(spec, 0.0, error=entry.result.type)
+            continue
+        message = entry.result.message
+        parsed = parse_response(message.content[0].text)
+        usage = add_usage(new_usage(), message.usage)
+        drop_truncated(parsed, message)
+        try:
+            fill_missing(client, parsed, usage=usage, **spec_refill(spec))
+        except Exception as e:
+            # The batch result is still worth writing; missing fields are reported
+            print(f"{spec['id']}: refill failed: {e}", file=sys.stderr)
+        missing = write_issue(sink, spec, parsed)
+        progress.record(spec, time.perf_counter() - start, usage, missing)
+    return progress.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate newsletters from a JSONL or CSV spec file.")
+    parser.add_argument('specs', help="JSONL or CSV file, one newsletter per row")
+    parser.add_argument('--out', required=True, help="output directory, or a .zip path")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rpm', type=int, default=50, help="requests per minute allowed on this API key")
+    parser.add_argument('--message-batches', action='store_true', help="submit through the Message Batches API")
+    parser.add_argument('--poll-interval', type=float, default=30.0)
+    parser.add_argument('--no-cache', action='store_true', help="don't reuse or store cached generations")
+    parser.add_argument('--base-url', default=os.environ.get('ANTHROPIC_BASE_URL'),
+                        help="API endpoint, e.g. a local fake server")
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get('ANTHROPIC_API_KEY')
+    if not api_key:
+        parser.error("set ANTHROPIC_API_KEY")
+    if args.out.endswith('.mbox'):
+        parser.error("--out must be a directory or a .zip path")
+    try:
+        specs = read_specs(args.specs)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    sink = open_sink(args.out)
+    manager = ClientManager(requests_per_minute=args.rpm, base_url=args.base_url)
+    try:
+        if args.message_batches:
+            summary = generate_message_batch(manager.client(api_key), specs, sink, args.poll_interval)
+        else:
+            cache = None if args.no_cache else default_cache()
+            batch = generate_batch(manager.async_client(api_key), specs, sink, args.concurrency, cache)
+            summary = manager.submit(batch).result()
+    finally:
+        sink.close()
+    summary['api'] = manager.metrics()
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+# The issue archive as it grows: saving an issue, listing the newest,
+# searching for a rare and a common word, and loading one issue back.
+#
+#     python -m bench.bench_archive
+import os
+import tempfile
+
+from archive import Archive
+from bench.timing import median_ms
+
+WORDS = ("garden volunteer drive gala spring harvest library shelter river cleanup youth mentoring "
+         "scholarship concert auction mural recycling pantry clinic").split()
+
+
+def sample_fields(i):
+    topic = WORDS[i % len(WORDS)]
+    body = ' '.join(WORDS[(i * 7 + n) % len(WORDS)] for n in range(120))
+    return {'Headline': f"Our {topic} update #{i}", 'Intro': body, 'Section 1': body[::-1], 'CTA': "Join us"}
+
+
+def fill(archive, count, start=0):
+    for i in range(start, count):
+        archive.save(None, f"hash{i}", f"Org {i % 50}", f"{WORDS[i % len(WORDS)]} issue", sample_fields(i),
+                     {'org_name': f"Org {i % 50}"}, "<html>" + "x" * 20000 + "</html>")
+
+
+def run(sizes=(100, 1000, 5000), repeat=20):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = Archive(os.path.join(tmp, 'issues.sqlite'))
+        filled = 0
+        for size in sizes:
+            fill(archive, size, filled)
+            filled = size
+            saved = iter(range(10 ** 6, 2 * 10 ** 6))
+            results.append({
+                'case': f"{size} issues",
+                'save_ms': median_ms(lambda: archive.save(None, f"new{next(saved)}", "Org", "theme",
+                                                          sample_fields(1), {}, "<html></html>"), repeat),
+                'recent_ms': median_ms(lambda: archive.search('', limit=8), repeat),
+                'search_rare_ms': median_ms(lambda: archive.search(f"update {size // 2}", limit=8), repeat),
+                'search_common_ms': median_ms(lambda: archive.search('garden', limit=8), repeat),
+                'load_ms': median_ms(lambda: archive.load(size // 2), repeat),
+            })
+    return results
+
+
+if __name__ == '__main__':
+    for r in run():
+        timings = ' '.join(f"{key}={value:.2f}" for key, value in r.items() if key.endswith('_ms'))
+        print(f"{r['case']:<14} {timings}")
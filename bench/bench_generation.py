@@ -0,0 +1,99 @@
+# End-to-end generation against bench.fake_anthropic over real HTTP: each
+# generation mode with response latency and streamed chunk latency, the
+# same with injected 429s, and a batch run. Measures what the user waits
+# for (first content, full newsletter) and throughput, including the SDK,
+# client manager, retries and parsing.
+#
+#     python -m bench.bench_generation
+import os
+import statistics
+import tempfile
+import time
+
+from batch import Progress, generate_batch, read_specs
+from bench.fake_anthropic import start_server
+from clients import ClientManager
+from generation import generate_newsletter, generate_sections, max_tokens_for, stream_newsletter
+from prompts import SECTIONS, build_prompt
+from sinks import DirectorySink
+
+PROMPT_ARGS = ("Be Newsie", "Spring volunteer drive", "- 40 new volunteers\n- Food bank expansion",
+               "Sign up for a shift", "Thank our sponsors",
+               "Health", "Free clinic hours", "Wealth", "Tax prep help", "Community", "Park cleanup",
+               "2-3 sentences")
+
+SCENARIOS = [
+    {'case': 'no latency'},
+    {'case': 'latency', 'latency': 0.2, 'chunk_latency': 0.005},
+    {'case': 'latency + 429 every 4th request', 'latency': 0.2, 'chunk_latency': 0.005,
+     'rate_limit_every': 4, 'retry_after': 0.2},
+]
+
+
+def run_mode(manager, mode):
+    client = manager.client("fake-key")
+    prompt = build_prompt(*PROMPT_ARGS)
+    max_tokens = max_tokens_for(length_instruction=PROMPT_ARGS[-1])
+    if mode == 'streaming':
+        return stream_newsletter(client, prompt, lambda label, value: None, max_tokens)
+    if mode == 'parallel':
+        section_prompts = {name: (labels, build_prompt(*PROMPT_ARGS, labels=labels),
+                                  max_tokens_for(labels, PROMPT_ARGS[-1]))
+                           for name, labels in SECTIONS.items()}
+        async_client = manager.async_client("fake-key")
+        return manager.run(lambda on_field: generate_sections(async_client, section_prompts, on_field))
+    return generate_newsletter(client, prompt, max_tokens)
+
+
+def run_batch(manager, issues=20, concurrency=4):
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+        for n in range(issues):
+            f.write(f'{{"org_name": "Chapter {n}", "theme": "Spring drive"}}\n')
+    specs = read_specs(f.name)
+    with tempfile.TemporaryDirectory() as out:
+        progress = Progress(len(specs), out=open(os.devnull, 'w'))
+        summary = manager.submit(generate_batch(manager.async_client("fake-key"), specs, DirectorySink(out),
+                                                concurrency, progress=progress)).result()
+    os.unlink(f.name)
+    return summary
+
+
+def run(repeat=5, batch_issues=20):
+    results = []
+    for scenario in SCENARIOS:
+        options = {key: value for key, value in scenario.items() if key != 'case'}
+        for mode in ('blocking', 'streaming', 'parallel'):
+            server = start_server(**options)
+            manager = ClientManager(requests_per_minute=6000, base_url=server.url)
+            first, total = [], []
+            for _ in range(repeat):
+                parsed, metrics = run_mode(manager, mode)
+                first.append(metrics['first_content_s'] * 1000)
+                total.append(metrics['total_s'] * 1000)
+            api = manager.metrics()
+            server.shutdown()
+            results.append({
+                'case': f"{mode}, {scenario['case']}",
+                'first_content_ms': statistics.median(first),
+                'total_ms': statistics.median(total),
+                'requests': api['requests'],
+                'retries': api['retries'],
+            })
+        server = start_server(**options)
+        manager = ClientManager(requests_per_minute=6000, base_url=server.url)
+        start = time.perf_counter()
+        summary = run_batch(manager, batch_issues)
+        server.shutdown()
+        results.append({
+            'case': f"batch of {batch_issues}, {scenario['case']}",
+            'total_ms': (time.perf_counter() - start) * 1000,
+            'issues_per_min': summary['issues_per_min'],
+            'failed': summary['failed'],
+            'retries': manager.metrics()['retries'],
+        })
+    return results
+
+
+if __name__ == '__main__':
+    for r in run():
+        print(r)
@@ -0,0 +1,56 @@
+# Upload preparation (images.prepare_image, which get_image/get_image_src
+# go through) for 1-10 MB uploads: the first time an upload is seen, a
+# rerun that hits the cache, and building the data URI the preview embeds.
+#
+#     python -m bench.bench_images
+import io
+import os
+
+import images
+from bench.timing import median_ms
+
+
+# A photo-like upload of roughly target_bytes: coarse noise scaled up so it
+# has both smooth areas and detail, saved as a high-quality JPEG or a PNG
+def make_upload(target_bytes, fmt='JPEG'):
+    from PIL import Image
+
+    width = 2000
+    for _ in range(4):
+        height = width * 3 // 4
+        small = Image.frombytes('RGB', (width // 8, height // 8), os.urandom((width // 8) * (height // 8) * 3))
+        img = small.resize((width, height), Image.BICUBIC)
+        buffer = io.BytesIO()
+        img.save(buffer, fmt, **({'quality': 95} if fmt == 'JPEG' else {}))
+        data = buffer.getvalue()
+        if abs(len(data) - target_bytes) < target_bytes * 0.15:
+            break
+        width = int(width * (target_bytes / len(data)) ** 0.5)
+    return data
+
+
+def run(repeat=3):
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return [{'case': 'skipped', 'note': "Pillow is not installed"}]
+    results = []
+    for size_mb, fmt in ((1, 'JPEG'), (2, 'JPEG'), (5, 'JPEG'), (10, 'JPEG'), (5, 'PNG')):
+        data = make_upload(size_mb * 1024 * 1024, fmt)
+        mime = f"image/{fmt.lower()}"
+        prepared = images.prepare_image(data, mime)
+        results.append({
+            'case': f"{size_mb} MB {fmt}",
+            'upload_bytes': len(data),
+            'output_bytes': prepared.size,
+            'cold_ms': median_ms(lambda: images.prepare_image(data, mime), repeat, setup=images._cache.clear),
+            'cached_ms': median_ms(lambda: images.prepare_image(data, mime), repeat * 10),
+            'data_uri_ms': median_ms(lambda: images.PreparedImage(prepared.data, prepared.mime, prepared.digest,
+                                                                  prepared.original_size).data_uri, repeat * 10),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    for r in run():
+        print(r)
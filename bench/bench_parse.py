@@ -0,0 +1,61 @@
+# Parser cost on realistic and malformed model output: every case in the
+# regression corpus, plus full-length responses in the formats models drift
+# into, parsed in one go and fed in streaming-sized chunks.
+#
+#     python -m bench.bench_parse
+import random
+
+from bench.check_parser import LABEL_STYLES, load_corpus
+from bench.timing import median_ms
+from parsing import IncrementalParser, parse_response
+from prompts import LABELS
+
+SENTENCE = "Our volunteers packed more than four hundred meal kits for families across the county this month."
+
+
+def long_response(sentences=5, style=0, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for label in LABELS:
+        head = LABEL_STYLES[style](label)
+        body = ' '.join([SENTENCE] * (sentences if 'CONTENT' in label or label in ('CEO_NOTE', 'ONE_MAIN_THING') else 1))
+        lines.append(f"{head} {body}")
+        if rng.random() < 0.3:
+            lines.append("")
+    return '\n'.join(lines)
+
+
+def feed_chunks(text, size):
+    parser = IncrementalParser()
+    for pos in range(0, len(text), size):
+        parser.feed(text[pos:pos + size])
+    parser.finish()
+    return parser.parsed
+
+
+def run(repeat=200):
+    results = []
+    for case in load_corpus():
+        text = case['text']
+        results.append({
+            'case': f"corpus: {case['name']}",
+            'bytes': len(text.encode('utf-8')),
+            'parse_ms': median_ms(lambda: parse_response(text), repeat),
+        })
+    for sentences in (3, 5, 20):
+        for style in range(len(LABEL_STYLES)):
+            text = long_response(sentences, style)
+            results.append({
+                'case': f"{sentences} sentences, label style {style}",
+                'bytes': len(text.encode('utf-8')),
+                'parse_ms': median_ms(lambda: parse_response(text), repeat),
+                # Deltas from the API are a few words each
+                'stream_parse_ms': median_ms(lambda: feed_chunks(text, 16), repeat),
+            })
+    return results
+
+
+if __name__ == '__main__':
+    for r in run():
+        stream = f"{r['stream_parse_ms']:>8.3f}" if 'stream_parse_ms' in r else ' ' * 8
+        print(f"{r['case']:<48} {r['bytes']:>7}B {r['parse_ms']:>8.3f} ms {stream}")
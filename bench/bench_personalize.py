@@ -0,0 +1,71 @@
+# Mass personalization: compiling the newsletter once, then rendering a
+# generated recipient list to .html and .eml, into a sink that discards the
+# output (render cost alone) and into real ZIP and mbox files.
+#
+#     python -m bench.bench_personalize
+import os
+import tempfile
+import time
+
+from bench.bench_render import sample_state
+from bench.timing import median_ms
+from personalize import Personalizer, personalize
+from render import newsletter_from_state
+from sinks import open_sink
+
+SEGMENT_LINKS = {'donors': "https://example.org/give", 'volunteers': "https://example.org/shifts"}
+
+
+class NullSink:
+    def write(self, name, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def recipients(count):
+    names = ["Ana", "Ben", "Chloé", "Dev", ""]
+    segments = ["donors", "volunteers", ""]
+    for i in range(count):
+        yield {'email': f"reader{i}@example.com", 'first_name': names[i % len(names)],
+               'segment': segments[i % len(segments)]}
+
+
+def compile_newsletter(doc):
+    return Personalizer(doc, segment_links=SEGMENT_LINKS, unsubscribe_url="https://example.org/unsubscribe?email={email}")
+
+
+def timed(personalizer, count, sink, fmt):
+    start = time.perf_counter()
+    try:
+        personalize(personalizer, recipients(count), sink, fmt)
+    finally:
+        sink.close()
+    return (time.perf_counter() - start) * 1000
+
+
+def run(count=10000, repeat=20):
+    results = []
+    for images in (0, 1):
+        doc = newsletter_from_state(sample_state(image_bytes=60 * 1024 if images else 0, images=images))
+        personalizer = compile_newsletter(doc)
+        case = f"{images} inline image{'s' if images != 1 else ''}"
+        results.append({'case': f"compile, {case}", 'compile_ms': median_ms(lambda: compile_newsletter(doc), repeat)})
+        for fmt in ('html', 'eml'):
+            render_ms = timed(personalizer, count, NullSink(), fmt)
+            results.append({'case': f"{count} {fmt}, {case}", 'render_ms': render_ms,
+                            'recipients_per_s': count / render_ms * 1000})
+            with tempfile.TemporaryDirectory() as tmp:
+                for extension in (('zip', 'mbox') if fmt == 'eml' else ('zip',)):
+                    path = os.path.join(tmp, f"out.{extension}")
+                    results.append({'case': f"{count} {fmt} to .{extension}, {case}",
+                                    'write_ms': timed(personalizer, count, open_sink(path, compress=fmt == 'html'), fmt),
+                                    'bytes': os.path.getsize(path)})
+    return results
+
+
+if __name__ == '__main__':
+    for r in run():
+        timings = ' '.join(f"{key}={value:.1f}" for key, value in r.items() if key.endswith(('_ms', '_per_s')))
+        print(f"{r['case']:<40} {timings}")
@@ -0,0 +1,272 @@
+# Rerun render cost of the old single f-string build_html against the
+# fragment-cached renderer in render.py, and the renderer's cold and warm
+# cost (plus the export-time optimize pass) across content lengths and
+# image counts.
+#
+#     python -m bench.bench_render
+import base64
+import os
+import time
+
+import render
+from bench.timing import median_ms
+from optimize import SizeBudget, optimize_html
+from render import newsletter_from_state, render_newsletter, render_plain_text
+
+
+# build_html as it was before render.py, kept as the baseline
+def legacy_image_html(image_src, section_name):
+    if image_src:
+        return f'<img src="{image_src}" alt="{section_name}" style="width: 100%; height: 160px; object-fit: cover; border-radius: 8px; margin-bottom: 12px;">'
+    return f'<div style="width: 100%; height: 120px; background: linear-gradient(135deg, #f8f9fa 0%, #e9ecef 100%); border-radius: 8px; margin-bottom: 12px; display: flex; align-items: center; justify-content: center; color: #adb5bd; font-size: 13px; border: 2px dashed #dee2e6;">📷 Add {section_name} image</div>'
+
+def legacy_build_html(org_name, org_tagline, org_website, org_logo, primary, secondary, accent, text_color,
+               section_label, hook, main_thing, ceo_note,
+               p1_name, p1_title, p1_content, p1_img,
+               p2_name, p2_title, p2_content, p2_img,
+               p3_name, p3_title, p3_content, p3_img,
+               cta_btn, cta_link, ps):
+    
+    logo_html = f'<img src="{org_logo}" alt="{org_name}" style="max-height: 50px; margin-bottom: 10px;">' if org_logo else ''
+    
+    return f"""<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"></head>
+<body style="margin: 0; padding: 0; background-color: #f5f5f5; font-family: Georgia, 'Times New Roman', serif;">
+<table width="100%" cellpadding="0" cellspacing="0" style="background-color: #f5f5f5; padding: 20px 0;">
+<tr><td align="center">
+<table width="600" cellpadding="0" cellspacing="0" style="background-color: #ffffff; border-radius: 12px; overflow: hidden; box-shadow: 0 4px 15px rgba(0,0,0,0.08);">
+
+<!-- Header -->
+<tr>
+<td style="background-color: {primary}; padding: 35px 40px; text-align: center;">
+{logo_html}
+<h1 style="color: #ffffff; margin: 0; font-size: 26px; font-weight: 700; letter-spacing: 0.5px;">{org_name.upper() if org_name else 'YOUR ORGANIZATION'}</h1>
+<p style="color: {accent}; margin: 8px 0 0 0; font-size: 13px; letter-spacing: 2px;">{org_tagline if org_tagline else ''}</p>
+</td>
+</tr>
+
+<!-- Opening Hook -->
+<tr>
+<td style="padding: 35px 40px 25px 40px;">
+<p style="font-size: 17px; line-height: 1.75; color: {text_color}; margin: 0;">{hook}</p>
+</td>
+</tr>
+
+<!-- One Main Thing -->
+<tr>
+<td style="padding: 10px 40px 25px 40px;">
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="background-color: #fffbf0; border-left: 4px solid {accent}; padding: 22px 25px; border-radius: 0 8px 8px 0;">
+<p style="color: {accent}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 10px 0;">✨ The One Thing</p>
+<p style="font-size: 15px; line-height: 1.65; color: {text_color}; margin: 0;">{main_thing}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>
+
+<!-- CEO Note -->
+<tr>
+<td style="padding: 10px 40px 25px 40px;">
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="background-color: #f8f9fa; border-radius: 8px; padding: 25px;">
+<p style="color: {primary}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 12px 0;">A Note From Our Team</p>
+<p style="font-size: 15px; line-height: 1.7; color: {text_color}; margin: 0; font-style: italic;">{ceo_note}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>
+
+<!-- Section Label -->
+<tr>
+<td style="padding: 15px 40px 5px 40px;">
+<p style="color: {primary}; font-size: 16px; font-weight: 700; text-align: center; margin: 0;">— {section_label} —</p>
+</td>
+</tr>
+
+<!-- Pillar 1 -->
+<tr>
+<td style="padding: 20px 40px 15px 40px;">
+{legacy_image_html(p1_img, p1_name)}
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="border-bottom: 2px solid {secondary}; padding-bottom: 18px;">
+<p style="color: {secondary}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 6px 0;">{p1_name}</p>
+<p style="color: {primary}; font-size: 16px; font-weight: 700; margin: 0 0 8px 0;">{p1_title}</p>
+<p style="font-size: 14px; line-height: 1.65; color: {text_color}; margin: 0;">{p1_content}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>
+
+<!-- Pillar 2 -->
+<tr>
+<td style="padding: 20px 40px 15px 40px;">
+{legacy_image_html(p2_img, p2_name)}
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="border-bottom: 2px solid {accent}; padding-bottom: 18px;">
+<p style="color: {accent}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 6px 0;">{p2_name}</p>
+<p style="color: {primary}; font-size: 16px; font-weight: 700; margin: 0 0 8px 0;">{p2_title}</p>
+<p style="font-size: 14px; line-height: 1.65; color: {text_color}; margin: 0;">{p2_content}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>
+
+<!-- Pillar 3 -->
+<tr>
+<td style="padding: 20px 40px 15px 40px;">
+{legacy_image_html(p3_img, p3_name)}
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="padding-bottom: 18px;">
+<p style="color: {primary}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 6px 0;">{p3_name}</p>
+<p style="color: {primary}; font-size: 16px; font-weight: 700; margin: 0 0 8px 0;">{p3_title}</p>
+<p style="font-size: 14px; line-height: 1.65; color: {text_color}; margin: 0;">{p3_content}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>
+
+<!-- CTA Button -->
+<tr>
+<td style="padding: 25px 40px 30px 40px; text-align: center;">
+<a href="{cta_link or '#'}" style="display: inline-block; background-color: {accent}; color: {primary}; font-size: 15px; font-weight: 700; text-decoration: none; padding: 16px 45px; border-radius: 6px; letter-spacing: 0.5px;">{cta_btn}</a>
+</td>
+</tr>
+
+<!-- PS Section -->
+<tr>
+<td style="padding: 20px 40px 30px 40px; border-top: 1px solid #eee;">
+<p style="font-size: 14px; line-height: 1.6; color: #7C7C7C; margin: 0;"><strong>P.S.</strong> {ps}</p>
+</td>
+</tr>
+
+<!-- Footer -->
+<tr>
+<td style="background-color: {primary}; padding: 25px 40px; text-align: center;">
+<p style="color: #ffffff; font-size: 12px; margin: 0 0 8px 0;">{org_name} {('| ' + org_website) if org_website else ''}</p>
+<p style="color: #aaa; font-size: 11px; margin: 0;">
+<a href="#" style="color: {secondary}; text-decoration: none;">Unsubscribe</a> · 
+<a href="#" style="color: {secondary}; text-decoration: none;">View in browser</a>
+</p>
+</td>
+</tr>
+
+</table>
+</td></tr>
+</table>
+</body>
+</html>"""
+
+
+def sample_state(image_bytes=0, sentences=3, images=3):
+    text = ' '.join(["Our community showed up in a big way this month."] * sentences)
+    img = None
+    if image_bytes:
+        img = "data:image/jpeg;base64," + base64.b64encode(os.urandom(image_bytes)).decode()
+    state = {
+        'org_name': "Be Newsie", 'org_tagline': "News that matters", 'org_website': "https://example.org",
+        'org_logo': "https://example.org/logo.png",
+        'primary': "#2C3E50", 'secondary': "#4F9DCB", 'accent': "#F7C548", 'text_color': "#2C3E50",
+        'section_label': "What's New", 'hook': text, 'main_thing': text, 'ceo_note': text,
+        'cta_btn': "Register now", 'cta_link': "https://example.org/register", 'ps': text,
+        'subj1': "Big news this month", 'subj2': "You showed up", 'subj3': "What's next for us",
+    }
+    for n, name in enumerate(["Health", "Wealth", "Community"], 1):
+        state[f'p{n}_name'] = name
+        state[f'p{n}_title'] = f"{name} headline"
+        state[f'p{n}_content'] = text
+        state[f'p{n}_img'] = img if n <= images else None
+    return state
+
+
+def legacy_render(state):
+    s = state
+    return legacy_build_html(
+        s['org_name'], s['org_tagline'], s['org_website'], s['org_logo'],
+        s['primary'], s['secondary'], s['accent'], s['text_color'],
+        s['section_label'], s['hook'], s['main_thing'], s['ceo_note'],
+        s['p1_name'], s['p1_title'], s['p1_content'], s['p1_img'],
+        s['p2_name'], s['p2_title'], s['p2_content'], s['p2_img'],
+        s['p3_name'], s['p3_title'], s['p3_content'], s['p3_img'],
+        s['cta_btn'], s['cta_link'], s['ps'])
+
+
+def fragment_render(state):
+    return render_newsletter(newsletter_from_state(state))
+
+
+# Simulates edit-mode reruns: every rerun renders the whole newsletter, and
+# when `edit` is set one pillar's text changes by a character first.
+def time_reruns(render, state, reruns, edit):
+    state = dict(state)
+    start = time.perf_counter()
+    for i in range(reruns):
+        if edit:
+            state['p2_content'] = state['p2_content'][:-1] + chr(97 + i % 26)
+        render(state)
+    return (time.perf_counter() - start) / reruns
+
+
+def run(reruns=200):
+    results = []
+    for image_bytes in (0, 1024 * 1024, 5 * 1024 * 1024):
+        state = sample_state(image_bytes)
+        assert legacy_render(state) == fragment_render(state)
+        for edit in (False, True):
+            before = time_reruns(legacy_render, state, reruns, edit)
+            after = time_reruns(fragment_render, state, reruns, edit)
+            results.append({
+                'case': f"{image_bytes // 1024} KB images, {'edit one pillar' if edit else 'unchanged'}",
+                'image_bytes': image_bytes,
+                'rerun': 'edit one pillar' if edit else 'unchanged',
+                'before_ms': before * 1000,
+                'after_ms': after * 1000,
+            })
+    return results
+
+
+def clear_render_caches():
+    for value in vars(render).values():
+        if hasattr(value, 'cache_clear'):
+            value.cache_clear()
+
+
+# With a host URL, so the optimize pass moves the images out as an export would
+HOSTED = SizeBudget(image_base_url="https://example.org/images/")
+
+
+# Cold is the first render of a newsletter (e.g. right after generating);
+# warm is a rerun with nothing changed. Images are sized like the output of
+# images.prepare_image, which keeps them under its 150 KB budget.
+def run_sizes(repeat=20):
+    results = []
+    for sentences in (2, 5, 20):
+        for images in (0, 1, 3):
+            doc = newsletter_from_state(sample_state(150 * 1024, sentences, images))
+            results.append({
+                'case': f"{sentences} sentences, {images} images",
+                'cold_ms': median_ms(lambda: render_newsletter(doc), repeat, setup=clear_render_caches),
+                'warm_ms': median_ms(lambda: render_newsletter(doc), repeat),
+                'plain_text_ms': median_ms(lambda: render_plain_text(doc), repeat),
+                'html_bytes': len(render_newsletter(doc).encode('utf-8')),
+                # The export pass: styles, whitespace, images out of line
+                'optimize_ms': median_ms(lambda: optimize_html(render_newsletter(doc), HOSTED), repeat),
+                'optimized_bytes': optimize_html(render_newsletter(doc), HOSTED).size,
+            })
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'images':>10}  {'rerun':<16} {'before ms':>10} {'after ms':>10}")
+    for r in run():
+        print(f"{r['image_bytes'] // 1024:>8}KB  {r['rerun']:<16} {r['before_ms']:>10.3f} {r['after_ms']:>10.3f}")
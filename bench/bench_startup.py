@@ -0,0 +1,100 @@
+# How long the app takes to come up. Each sample is a fresh Python process,
+# like a new container, running app.py under Streamlit's AppTest:
+#   cold_ms         first run, importing the app's modules and building the
+#                   cached resources
+#   new_session_ms  another session in the same, now warm, process
+#   rerun_ms        a rerun of that session, as after any interaction
+# It also checks that nothing on the startup path imported the Anthropic SDK.
+#
+#     python -m bench.bench_startup                 # 5 processes, medians
+#     python -m bench.bench_startup --max-ms 2500   # exit 1 if cold start is slower, for CI
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+# Imported at startup only if something loads it eagerly
+HEAVY_MODULES = ('anthropic', 'PIL', 'duckduckgo_search')
+
+
+def _runs(at_factory):
+    at = at_factory()
+    start = time.perf_counter()
+    at.run()
+    cold_ms = (time.perf_counter() - start) * 1000
+    at = at_factory()
+    start = time.perf_counter()
+    at.run()
+    new_session_ms = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    start = time.perf_counter()
+    at.run()
+    return cold_ms, new_session_ms, (time.perf_counter() - start) * 1000
+
+
+# One sample, run inside the fresh process. AppTest does work of its own on
+# every run, so the same runs of an empty script are measured first and
+# taken off; what's left is the app.
+def measure():
+    from streamlit.testing.v1 import AppTest
+
+    empty = _runs(lambda: AppTest.from_string("import streamlit as st", default_timeout=60))
+    app = _runs(lambda: AppTest.from_file(APP, default_timeout=60))
+    row = {key: max(0.0, a - e) for key, a, e in zip(('cold_ms', 'new_session_ms', 'rerun_ms'), app, empty)}
+    row['loaded'] = [name for name in HEAVY_MODULES if name in sys.modules]
+    return row
+
+
+def sample():
+    repo = os.path.dirname(APP)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Run from an empty directory: the app keeps its caches, traces and
+        # archive under the working directory, so nothing lands in the tree
+        # and every sample starts from none of them
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [repo, os.environ.get('PYTHONPATH')]))}
+        env.pop('NEWSIE_ARCHIVE', None)
+        out = subprocess.run([sys.executable, '-m', 'bench.bench_startup', '--sample'], capture_output=True,
+                             text=True, check=True, env=env, cwd=tmp).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(processes=5):
+    samples = [sample() for _ in range(processes)]
+    row = {'case': f"app.py, median of {processes} processes"}
+    for key in ('cold_ms', 'new_session_ms', 'rerun_ms'):
+        row[key] = statistics.median(s[key] for s in samples)
+    row['loaded'] = sorted({name for s in samples for name in s['loaded']})
+    return [row]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app.py's cold start.")
+    parser.add_argument('--processes', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, help="fail if the median cold start is slower than this")
+    parser.add_argument('--sample', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.sample:
+        print(json.dumps(measure()))
+        return 0
+
+    row = run(args.processes)[0]
+    print(f"{row['case']}: cold {row['cold_ms']:.0f} ms · new session {row['new_session_ms']:.0f} ms · "
+          f"rerun {row['rerun_ms']:.0f} ms")
+    failed = False
+    if row['loaded']:
+        print(f"FAIL imported at startup: {', '.join(row['loaded'])}")
+        failed = True
+    if args.max_ms is not None and row['cold_ms'] > args.max_ms:
+        print(f"FAIL cold start {row['cold_ms']:.0f} ms is over {args.max_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# Regression corpus and fuzzer for parsing.py.
+#
+#     python -m bench.check_parser [--fuzz 2000] [--seed 0]
+#
+# Every case in parser_corpus.jsonl must parse to its expected fields and
+# report exactly its expected missing labels. Long runs of heading, quote
+# and bullet markers must parse in linear time. The fuzzer then formats a clean
+# response the ways models drift from the spec (bold, numbering, headings,
+# blank lines, CRLF...) and feeds it in random chunk sizes, as streaming does;
+# the result must match the clean parse.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from parsing import IncrementalParser, missing_fields, parse_response
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'parser_corpus.jsonl')
+
+
+def load_corpus(path=CORPUS):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_corpus(cases):
+    failures = []
+    for case in cases:
+        parsed = parse_response(case['text'])
+        wrong = {label: parsed.get(label) for label, value in case['expected'].items() if parsed.get(label) != value}
+        missing = missing_fields(parsed)
+        if wrong or missing != case['missing']:
+            failures.append(f"{case['name']}: wrong {wrong}, missing {missing}")
+    return failures
+
+
+LABEL_STYLES = [
+    lambda label: f"{label}:",
+    lambda label: f"**{label}:**",
+    lambda label: f"**{label}**:",
+    lambda label: f"- {label}:",
+    lambda label: f"### {label}:",
+    lambda label: f"{label.replace('_', ' ').title()}:",
+]
+
+
+def fuzz_text(rng, fields):
+    lines = []
+    if rng.random() < 0.3:
+        lines.append("Sure! Here's the newsletter:\n")
+    for i, (label, value) in enumerate(fields.items(), 1):
+        head = rng.choice(LABEL_STYLES)(label)
+        if rng.random() < 0.2:
+            head = f"{i}. {head}"
+        if rng.random() < 0.2:
+            lines.append(head)
+            lines.append(value)
+        else:
+            lines.append(f"{head} {value}")
+        if rng.random() < 0.3:
+            lines.append(rng.choice(["", "---", ""]))
+    newline = '\r\n' if rng.random() < 0.2 else '\n'
+    return newline.join(lines)
+
+
+def feed_in_chunks(rng, text):
+    parser = IncrementalParser()
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, 40)
+        parser.feed(text[pos:pos + size])
+        pos += size
+    parser.finish()
+    return parser.parsed
+
+
+def fuzz(fields, iterations, seed):
+    rng = random.Random(seed)
+    failures = []
+    for i in range(iterations):
+        text = fuzz_text(rng, fields)
+        parsed = feed_in_chunks(rng, text)
+        if parsed != fields:
+            failures.append(f"fuzz #{i}: {json.dumps(text)[:300]}")
+    return failures
+
+
+# Marker-only lines like these once sent the label regex into exponential
+# backtracking; a 24 character line took seconds
+PATHOLOGICAL_LINES = ['#' * 2000, '>' * 2000, '# > ' * 500, '- ' * 1000, '1. ' * 700, '#' * 2000 + ' x']
+LINE_BUDGET_MS = 50
+
+
+def check_pathological(lines=PATHOLOGICAL_LINES, budget_ms=LINE_BUDGET_MS):
+    failures = []
+    for line in lines:
+        start = time.perf_counter()
+        parse_response(f"OPENING_HOOK: Hello\n{line}\nCTA_BUTTON: Join")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > budget_ms:
+            failures.append(f"slow line {line[:12]!r}... ({len(line)} chars): {elapsed_ms:.0f} ms")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check parsing.py against the regression corpus and fuzzer.")
+    parser.add_argument('--fuzz', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    cases = load_corpus()
+    failures = check_corpus(cases)
+    clean = cases[0]['expected']
+    failures += fuzz(clean, args.fuzz, args.seed)
+    failures += check_pathological()
+    for failure in failures:
+        print(failure)
+    print(f"{len(cases)} corpus cases, {args.fuzz} fuzz cases, {len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# Compares two bench.run result files case by case. Timings (fields ending
+# in _ms) that got slower by more than --threshold percent are flagged, and
+# the exit status is 1 if any were, so CI can fail on a regression.
+#
+#     python -m bench.compare .newsie_bench/before.json .newsie_bench/after.json --threshold 15
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        report = json.load(f)
+    return report, {(row['suite'], row['case']): row for row in report['results']}
+
+
+def compare(before, after, threshold):
+    lines = []
+    regressions = 0
+    for key, new in after.items():
+        old = before.get(key)
+        if old is None:
+            continue
+        for field, value in new.items():
+            if not field.endswith('_ms') or not isinstance(old.get(field), (int, float)) or not old[field]:
+                continue
+            change = (value - old[field]) / old[field] * 100
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            lines.append(f"{key[0]:<12} {key[1]:<48} {field:<18} {old[field]:>10.3f} → {value:>10.3f} "
+                         f"{change:>+7.1f}%{flag}")
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0, help="percent slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    before_report, before = load(args.before)
+    after_report, after = load(args.after)
+    print(f"{before_report.get('commit')} → {after_report.get('commit')}")
+    lines, regressions = compare(before, after, args.threshold)
+    for line in lines:
+        print(line)
+    print(f"{regressions} regression(s) over {args.threshold:.0f}%")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+# Local stand-in for the Anthropic Messages API, for exercising the batch
+# runner and benchmarks without a key or network access. Point a client at
+# it with anthropic.Anthropic(api_key="fake", base_url=url). Supports
+# streaming, per-chunk latency and injected 429s.
+#
+#     python -m bench.fake_anthropic --port 8765 --latency 0.5 --chunk-latency 0.02 --rate-limit-every 5
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LABEL_LINE = re.compile(r'^([A-Z][A-Z0-9_]+): \[', re.MULTILINE)
+FIELDS_LINE = re.compile(r'^FIELDS TO WRITE: (.+)$', re.MULTILINE)
+
+
+def prompt_text(body):
+    parts = []
+    system = body.get('system')
+    if isinstance(system, str):
+        parts.append(system)
+    elif system:
+        parts.extend(block.get('text', '') for block in system)
+    for message in body.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get('text', '') for block in content)
+    return '\n'.join(parts)
+
+
+# Answers the labels listed under FIELDS TO WRITE, or failing that every
+# "LABEL: [...]" line of the format spec, with filler copy
+def completion_text(body):
+    text = prompt_text(body)
+    listed = FIELDS_LINE.findall(text)
+    labels = [label.strip() for label in listed[-1].split(',')] if listed else LABEL_LINE.findall(text)
+    return '\n'.join(f"{label}: Fake copy for {label.lower().replace('_', ' ')}." for label in labels)
+
+
+# System blocks marked with cache_control are billed as a cache write the
+# first time the server sees them and as a cache read after that
+def usage_json(body, text, cached_prefixes=None):
+    system = body.get('system')
+    prefix = ''
+    if isinstance(system, list) and any(block.get('cache_control') for block in system):
+        prefix = ''.join(block.get('text', '') for block in system)
+    prompt_tokens = len(prompt_text(body)) // 4
+    prefix_tokens = len(prefix) // 4
+    written = read = 0
+    if prefix and cached_prefixes is not None:
+        if prefix in cached_prefixes:
+            read = prefix_tokens
+        else:
+            cached_prefixes.add(prefix)
+            written = prefix_tokens
+    return {'input_tokens': prompt_tokens - written - read, 'cache_creation_input_tokens': written,
+            'cache_read_input_tokens': read, 'output_tokens': len(text) // 4}
+
+
+def message_json(body, text, cached_prefixes=None):
+    return {
+        'id': f"msg_fake_{uuid.uuid4().hex[:12]}",
+        'type': 'message',
+        'role': 'assistant',
+        'model': body.get('model', 'fake'),
+        'content': [{'type': 'text', 'text': text}],
+        'stop_reason': 'end_turn',
+        'stop_sequence': None,
+        'usage': usage_json(body, text, cached_prefixes),
+    }
+
+
+# The events of a streamed response, with the text split into a few words
+# per delta the way the real API sends it
+def stream_events(message, words_per_chunk=4):
+    usage = message['usage']
+    start = dict(message, content=[], stop_reason=None, usage=dict(usage, output_tokens=1))
+    yield 'message_start', {'type': 'message_start', 'message': start}
+    yield 'content_block_start', {'type': 'content_block_start', 'index': 0,
+                                  'content_block': {'type': 'text', 'text': ''}}
+    words = re.findall(r'\S+\s*|\s+', message['content'][0]['text'])
+    for i in range(0, len(words), words_per_chunk):
+        yield 'content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                      'delta': {'type': 'text_delta', 'text': ''.join(words[i:i + words_per_chunk])}}
+    yield 'content_block_stop', {'type': 'content_block_stop', 'index': 0}
+    yield 'message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                            'usage': {'output_tokens': usage['output_tokens']}}
+    yield 'message_stop', {'type': 'message_stop'}
+
+
+class FakeAnthropicHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200, content_type='application/json'):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path.startswith('/v1/messages/batches'):
+            return self._create_batch(body)
+        if self.path.startswith('/v1/messages'):
+            if self.server.should_rate_limit():
+                return self._send_rate_limit()
+            time.sleep(self.server.latency)
+            message = message_json(body, completion_text(body), self.server.cached_prefixes)
+            if body.get('stream'):
+                return self._send_stream(message)
+            return self._send_json(message)
+        self._send_json({'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}}, 404)
+
+    def _send_rate_limit(self):
+        data = json.dumps({'type': 'error', 'error': {'type': 'rate_limit_error',
+                                                      'message': 'Fake rate limit'}}).encode()
+        self.send_response(429)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('retry-after', str(self.server.retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, message):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event, data in stream_events(message):
+            payload = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+            if event == 'content_block_delta':
+                time.sleep(self.server.chunk_latency)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        match = re.match(r'^/v1/messages/batches/([^/?]+)(/results)?', self.path)
+        batch = self.server.batches.get(match.group(1)) if match else None
+        if batch is None:
+            return self._send_json({'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}}, 404)
+        if match.group(2):
+            lines = [json.dumps({'custom_id': custom_id, 'result': {'type': 'succeeded', 'message': message}})
+                     for custom_id, message in batch['results']]
+            return self._send_json('\n'.join(lines).encode(), content_type='application/binary')
+        self._send_json(self._batch_json(batch))
+
+    def _create_batch(self, body):
+        batch_id = f"msgbatch_fake_{uuid.uuid4().hex[:12]}"
+        results = [(request['custom_id'], message_json(request['params'], completion_text(request['params'])))
+                   for request in body.get('requests', [])]
+        self.server.batches[batch_id] = {
+            'id': batch_id,
+            'created': datetime.now(timezone.utc),
+            'ready_at': time.monotonic() + self.server.latency,
+            'results': results,
+        }
+        self._send_json(self._batch_json(self.server.batches[batch_id]))
+
+    def _batch_json(self, batch):
+        ended = time.monotonic() >= batch['ready_at']
+        count = len(batch['results'])
+        host, port = self.server.server_address[:2]
+        return {
+            'id': batch['id'],
+            'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': {'processing': 0 if ended else count, 'succeeded': count if ended else 0,
+                               'errored': 0, 'canceled': 0, 'expired': 0},
+            'created_at': batch['created'].isoformat(),
+            'expires_at': (batch['created'] + timedelta(days=1)).isoformat(),
+            'ended_at': datetime.now(timezone.utc).isoformat() if ended else None,
+            'archived_at': None,
+            'cancel_initiated_at': None,
+            'results_url': f"http://{host}:{port}/v1/messages/batches/{batch['id']}/results" if ended else None,
+        }
+
+
+class FakeAnthropicServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # latency is the wait before each response starts, chunk_latency the
+    # wait between streamed deltas. Every rate_limit_every-th messages
+    # request gets a 429 with a retry-after of retry_after seconds.
+    def __init__(self, address, latency=0.0, chunk_latency=0.0, rate_limit_every=0, retry_after=0.1):
+        super().__init__(address, FakeAnthropicHandler)
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.batches = {}
+        self.cached_prefixes = set()
+        self.requests = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def should_rate_limit(self):
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+                self.rate_limited += 1
+                return True
+            return False
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+# Starts a server on a free port in a background thread
+def start_server(latency=0.0, host='127.0.0.1', port=0, **options):
+    server = FakeAnthropicServer((host, port), latency=latency, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake Anthropic Messages API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument('--chunk-latency', type=float, default=0.0, help="seconds between streamed text deltas")
+    parser.add_argument('--rate-limit-every', type=int, default=0, help="answer every Nth request with a 429")
+    parser.add_argument('--retry-after', type=float, default=0.1, help="retry-after sent with injected 429s")
+    args = parser.parse_args()
+    server = FakeAnthropicServer((args.host, args.port), latency=args.latency, chunk_latency=args.chunk_latency,
+                                 rate_limit_every=args.rate_limit_every, retry_after=args.retry_after)
+    print(f"Fake Anthropic API listening on {server.url}")
+    server.serve_forever()
@@ -0,0 +1,80 @@
+# Runs the benchmark suites and writes the results as JSON, named after the
+# current commit, so two commits can be compared with bench.compare.
+#
+#     python -m bench.run                      # everything
+#     python -m bench.run --quick --suites render,parse
+#     python -m bench.compare .newsie_bench/abc1234.json .newsie_bench/def5678.json
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from bench import bench_archive, bench_generation, bench_images, bench_parse, bench_personalize, bench_render, bench_startup
+
+RESULTS_DIR = ".newsie_bench"
+
+# suite name -> (full run, quick run)
+SUITES = {
+    'render': (lambda: bench_render.run_sizes(50), lambda: bench_render.run_sizes(5)),
+    'render_legacy': (lambda: bench_render.run(200), lambda: bench_render.run(20)),
+    'parse': (lambda: bench_parse.run(200), lambda: bench_parse.run(20)),
+    'images': (lambda: bench_images.run(3), lambda: bench_images.run(1)),
+    'generation': (lambda: bench_generation.run(5, 20), lambda: bench_generation.run(2, 8)),
+    'personalize': (lambda: bench_personalize.run(10000, 20), lambda: bench_personalize.run(1000, 3)),
+    'startup': (lambda: bench_startup.run(5), lambda: bench_startup.run(2)),
+    'archive': (lambda: bench_archive.run((100, 1000, 5000), 20), lambda: bench_archive.run((100, 1000), 5)),
+}
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suites and save the results as JSON.")
+    parser.add_argument('--suites', default=','.join(SUITES), help=f"comma-separated, from {', '.join(SUITES)}")
+    parser.add_argument('--quick', action='store_true', help="fewer repeats, for a smoke run")
+    parser.add_argument('--out', help=f"results file (default {RESULTS_DIR}/<commit>.json)")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.suites.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SUITES]
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(unknown)}")
+
+    commit = git_commit()
+    results = []
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        rows = SUITES[name][1 if args.quick else 0]()
+        for row in rows:
+            results.append({'suite': name, 'case': row.pop('case'), **row})
+
+    report = {
+        'commit': commit,
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': args.quick,
+        'results': results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"{len(results)} results written to {out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,15 @@
+import statistics
+import time
+
+
+# Median wall time of fn() over `repeat` calls, in milliseconds. setup()
+# runs before each call and isn't timed.
+def median_ms(fn, repeat=20, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_PATH = os.path.join(".newsie_cache", "generations.sqlite")
+
+
+def cache_key(prompt, model, max_tokens):
+    # Whitespace differences in the form inputs shouldn't miss the cache
+    normalized = ' '.join(prompt.split())
+    payload = json.dumps([normalized, model, max_tokens])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# In-process LRU keyed by cache_key, evicted by entry count and age
+class MemoryStore:
+    def __init__(self, max_entries=256, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if time.time() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# SQLite store shared by every session of the process and kept across
+# restarts. Evicts by age and total stored bytes, least recently used first.
+class SQLiteStore:
+    def __init__(self, path=DEFAULT_PATH, max_bytes=50 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS generations (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL)""")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE generations SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        data = json.dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?)",
+                               (key, data, len(data), now, now))
+            self._evict(now)
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM generations")
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM generations WHERE created < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM generations ORDER BY accessed").fetchall():
+            self._conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+# Looks entries up in each store in order and back-fills the faster ones on
+# a hit. Values are {'text': raw completion, 'parsed': {label: value}}.
+class GenerationCache:
+    def __init__(self, stores):
+        self.stores = stores
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prompt, model, max_tokens):
+        key = cache_key(prompt, model, max_tokens)
+        for i, store in enumerate(self.stores):
+            value = store.get(key)
+            if value is not None:
+                for faster in self.stores[:i]:
+                    faster.put(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, prompt, model, max_tokens, text, parsed):
+        key = cache_key(prompt, model, max_tokens)
+        value = {'text': text, 'parsed': parsed}
+        for store in self.stores:
+            store.put(key, value)
+
+    def clear(self):
+        for store in self.stores:
+            store.clear()
+
+    def bypass(self):
+        return BypassCache(self)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Used for "regenerate": skips lookups but still records the fresh result
+class BypassCache:
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, prompt, model, max_tokens):
+        return None
+
+    def put(self, prompt, model, max_tokens, text, parsed):
+        self.cache.put(prompt, model, max_tokens, text, parsed)
+
+
+def default_cache(path=DEFAULT_PATH):
+    return GenerationCache([MemoryStore(), SQLiteStore(path)])
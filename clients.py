@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import queue
+import random
+import sys
+import threading
+import time
+
+# Worth waiting out: rate limits, overload and transient server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+MAX_ATTEMPTS = 6
+MAX_BACKOFF = 60.0
+
+
+def retry_delay(error, attempt):
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return min(MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+# The SDK takes about a second to import, so it's loaded with the first
+# client rather than when the app starts
+def is_retryable(error):
+    import anthropic
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+# A rejected API key. If the SDK was never imported, no call was made and the
+# error can't be one, so checking doesn't load it.
+def is_auth_error(error):
+    anthropic = sys.modules.get('anthropic')
+    return anthropic is not None and isinstance(error, anthropic.AuthenticationError)
+
+
+# Requests-per-minute limit shared by everyone using one API key, so bursts
+# from several sessions queue up here instead of coming back as 429s
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, float(per_minute) / 6)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Takes a token if one is free, otherwise returns how long to wait
+    def _take(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        waited = 0.0
+        while (delay := self._take()) > 0:
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+    async def acquire_async(self):
+        waited = 0.0
+        while (delay := self._take()) > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+        return waited
+
+    # A retry-after from the API holds back every caller on the key
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class KeyMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.retry_wait_s = 0.0
+        self.queue_wait_s = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, requests=0, retries=0, retry_wait_s=0.0, queue_wait_s=0.0):
+        with self._lock:
+            self.requests += requests
+            self.retries += retries
+            self.retry_wait_s += retry_wait_s
+            self.queue_wait_s += queue_wait_s
+
+    def snapshot(self):
+        with self._lock:
+            return {'requests': self.requests, 'retries': self.retries,
+                    'retry_wait_s': self.retry_wait_s, 'queue_wait_s': self.queue_wait_s}
+
+
+# Wraps an SDK client so every messages call goes through the key's token
+# bucket and is retried with backoff. Only what this app uses is wrapped.
+class ManagedClient:
+    def __init__(self, client, bucket, metrics):
+        self.client = client
+        self.bucket = bucket
+        self.metrics = metrics
+        self.messages = _Messages(self)
+
+    def call(self, fn):
+        import anthropic
+        for attempt in range(MAX_ATTEMPTS):
+            self.metrics.add(requests=1, queue_wait_s=self.bucket.acquire())
+            try:
+                return fn()
+            except anthropic.APIError as e:
+                if attempt == MAX_ATTEMPTS - 1 or not is_retryable(e):
+                    raise
+                delay = retry_delay(e, attempt)
+                self.bucket.pause(delay)
+                self.metrics.add(retries=1, retry_wait_s=delay)
+                time.sleep(delay)
+
+
+class _Messages:
+    def __init__(self, managed):
+        self._managed = managed
+
+    def create(self, **params):
+        return self._managed.call(lambda: self._managed.client.messages.create(**params))
+
+    def stream(self, **params):
+        return _ManagedStream(self._managed, params)
+
+    @property
+    def batches(self):
+        return self._managed.client.messages.batches
+
+
+# The request is sent when the stream is entered, so that's what is retried
+class _ManagedStream:
+    def __init__(self, managed, params):
+        self._managed = managed
+        self._params = params
+        self._manager = None
+
+    def __enter__(self):
+        def open_stream():
+            manager = self._managed.client.messages.stream(**self._params)
+            stream = manager.__enter__()
+            self._manager = manager
+            return stream
+        return self._managed.call(open_stream)
+
+    def __exit__(self, *exc):
+        return self._manager.__exit__(*exc)
+
+
+class ManagedAsyncClient:
+    def __init__(self, client, bucket, metrics):
+        self.client = client
+        self.bucket = bucket
+        self.metrics = metrics
+        self.messages = _AsyncMessages(self)
+
+    async def call(self, fn):
+        import anthropic
+        for attempt in range(MAX_ATTEMPTS):
+            self.metrics.add(requests=1, queue_wait_s=await self.bucket.acquire_async())
+            try:
+                return await fn()
+            except anthropic.APIError as e:
+                if attempt == MAX_ATTEMPTS - 1 or not is_retryable(e):
+                    raise
+                delay = retry_delay(e, attempt)
+                self.bucket.pause(delay)
+                self.metrics.add(retries=1, retry_wait_s=delay)
+                await asyncio.sleep(delay)
+
+
+class _AsyncMessages:
+    def __init__(self, managed):
+        self._managed = managed
+
+    async def create(self, **params):
+        return await self._managed.call(lambda: self._managed.client.messages.create(**params))
+
+
+def api_key_id(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+# One SDK client per API key for the whole process, so reruns and sessions
+# reuse its pooled keep-alive connections instead of reconnecting. Async
+# clients are tied to an event loop, so async work runs on one long-lived
+# loop thread owned by the manager.
+class ClientManager:
+    def __init__(self, requests_per_minute=50, base_url=None):
+        self.requests_per_minute = requests_per_minute
+        self.base_url = base_url
+        self._clients = {}
+        self._async_clients = {}
+        self._buckets = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def _shared(self, key_id):
+        if key_id not in self._buckets:
+            self._buckets[key_id] = TokenBucket(self.requests_per_minute)
+            self._metrics[key_id] = KeyMetrics()
+        return self._buckets[key_id], self._metrics[key_id]
+
+    def client(self, api_key):
+        import anthropic
+        key_id = api_key_id(api_key)
+        with self._lock:
+            if key_id not in self._clients:
+                # Retries are ours, so they share the key's bucket
+                sdk = anthropic.Anthropic(api_key=api_key, base_url=self.base_url, max_retries=0)
+                self._clients[key_id] = ManagedClient(sdk, *self._shared(key_id))
+            return self._clients[key_id]
+
+    def async_client(self, api_key):
+        import anthropic
+        key_id = api_key_id(api_key)
+        with self._lock:
+            if key_id not in self._async_clients:
+                sdk = anthropic.AsyncAnthropic(api_key=api_key, base_url=self.base_url, max_retries=0)
+                self._async_clients[key_id] = ManagedAsyncClient(sdk, *self._shared(key_id))
+            return self._async_clients[key_id]
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="anthropic-clients", daemon=True).start()
+            return self._loop
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # Runs make_coro(callback) on the manager's loop and blocks until it's done.
+    # Calls the coroutine makes to callback are replayed on the calling thread,
+    # where Streamlit elements can be updated.
+    def run(self, make_coro, callback=None):
+        calls = queue.Queue()
+        future = self.submit(make_coro(lambda *args: calls.put(args)))
+        while not future.done() or not calls.empty():
+            try:
+                args = calls.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if callback:
+                callback(*args)
+        return future.result()
+
+    def metrics(self):
+        totals = KeyMetrics()
+        with self._lock:
+            for metrics in self._metrics.values():
+                totals.add(**metrics.snapshot())
+        return totals.snapshot()
@@ -0,0 +1,339 @@
+import asyncio
+import json
+import time
+
+from clients import is_auth_error
+from parsing import IncrementalParser, missing_fields, parse_response, parse_tool_use, tool_input
+from prompts import LABELS, MAX_SENTENCES, MODEL, SYSTEM, SYSTEM_PROMPT
+from tracing import NULL_TRACE
+
+# Output budget for the fields whose length doesn't depend on the length
+# option, in tokens. The rest get TOKENS_PER_SENTENCE for each sentence
+# asked for, with some headroom so a long answer isn't cut off mid-field.
+FIELD_TOKENS = {
+    'SUBJECT_LINE_1': 30, 'SUBJECT_LINE_2': 30, 'SUBJECT_LINE_3': 30,
+    'OPENING_HOOK': 150,
+    'PILLAR1_TITLE': 30, 'PILLAR2_TITLE': 30, 'PILLAR3_TITLE': 30,
+    'CTA_BUTTON': 20,
+    'PS_TEXT': 100,
+}
+TOKENS_PER_SENTENCE = 45
+LABEL_TOKENS = 10
+
+
+def max_tokens_for(labels=LABELS, length_instruction="4-5 sentences"):
+    sentences = MAX_SENTENCES.get(length_instruction, 5)
+    return sum(LABEL_TOKENS + FIELD_TOKENS.get(label, TOKENS_PER_SENTENCE * sentences) for label in labels)
+
+
+MAX_TOKENS = max_tokens_for()
+
+
+def request_params(prompt, max_tokens, **extra):
+    return dict(model=MODEL, max_tokens=max_tokens, system=SYSTEM,
+                messages=[{"role": "user", "content": prompt}], **extra)
+
+
+USAGE_FIELDS = ('input_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens', 'output_tokens')
+
+
+# Running token totals for one generation, across every request it made
+def add_usage(totals, usage):
+    for field in USAGE_FIELDS:
+        totals[field] = totals.get(field, 0) + (getattr(usage, field, None) or 0)
+    return totals
+
+
+def new_usage():
+    return dict.fromkeys(USAGE_FIELDS, 0)
+
+
+# The system block is part of what was asked, so a change to it shouldn't
+# replay copy written against the old one. Structured output also keys on
+# its tool schema, so it and the text modes never replay each other's results.
+def cache_prompt(prompt, tool=None):
+    key = f"{SYSTEM_PROMPT}\n\n{prompt}"
+    if tool is not None:
+        key += f"\n\n{json.dumps(tool, sort_keys=True)}"
+    return key
+
+
+def cached_response(cache, prompt, max_tokens, tool=None):
+    if cache is None:
+        return None
+    return cache.get(cache_prompt(prompt, tool), MODEL, max_tokens)
+
+
+# Only complete responses are worth replaying
+def store_response(cache, prompt, max_tokens, text, parsed, labels=LABELS, tool=None):
+    if cache is not None and all(label in parsed for label in labels):
+        cache.put(cache_prompt(prompt, tool), MODEL, max_tokens, text, parsed)
+
+
+# A response cut off at max_tokens may end mid-field, so the last field it
+# wrote is dropped to be asked for again rather than kept as complete.
+# written is the labels in the order they were written; parsed's by default.
+def drop_truncated(parsed, message, written=None):
+    if message.stop_reason != 'max_tokens':
+        return False
+    written = list(parsed) if written is None else written
+    if written:
+        parsed.pop(written[-1], None)
+    return True
+
+
+# Asks again for only the fields a response left out, and returns the text
+# that came back ('' if nothing was missing). prompt_for(labels) builds a
+# prompt for just those labels and tokens_for(labels) their output budget.
+def fill_missing(client, parsed, prompt_for, on_field=None, usage=None, trace=NULL_TRACE, tokens_for=max_tokens_for):
+    missing = missing_fields(parsed)
+    if not missing:
+        return ''
+    with trace.span('refill_api'):
+        message = client.messages.create(**request_params(prompt_for(missing), tokens_for(missing)))
+    return _merge_refill(parsed, missing, message, on_field, usage, trace)
+
+
+async def fill_missing_async(async_client, parsed, prompt_for, on_field=None, usage=None, trace=NULL_TRACE,
+                             tokens_for=max_tokens_for):
+    missing = missing_fields(parsed)
+    if not missing:
+        return ''
+    with trace.span('refill_api'):
+        message = await async_client.messages.create(**request_params(prompt_for(missing), tokens_for(missing)))
+    return _merge_refill(parsed, missing, message, on_field, usage, trace)
+
+
+def _merge_refill(parsed, missing, message, on_field, usage, trace):
+    if usage is not None:
+        add_usage(usage, message.usage)
+    text = message.content[0].text
+    with trace.span('parse'):
+        found = parse_response(text)
+    drop_truncated(found, message)
+    for label in missing:
+        if found.get(label):
+            parsed[label] = found[label]
+            if on_field:
+                on_field(label, found[label])
+    return text
+
+
+def generate_newsletter(client, prompt, max_tokens=MAX_TOKENS, cache=None, prompt_for=None, trace=NULL_TRACE):
+    start = time.perf_counter()
+    with trace.span('cache_lookup'):
+        hit = cached_response(cache, prompt, max_tokens)
+    refilled = []
+    truncated = False
+    usage = new_usage()
+    if hit is not None:
+        parsed = hit['parsed']
+    else:
+        with trace.span('api'):
+            message = client.messages.create(**request_params(prompt, max_tokens))
+        add_usage(usage, message.usage)
+        text = message.content[0].text
+        with trace.span('parse'):
+            parsed = parse_response(text)
+        truncated = drop_truncated(parsed, message)
+        if prompt_for:
+            refilled = missing_fields(parsed)
+            text += '\n' + fill_missing(client, parsed, prompt_for, usage=usage, trace=trace)
+        if not truncated:
+            store_response(cache, prompt, max_tokens, text, parsed)
+    elapsed = time.perf_counter() - start
+    metrics = {'mode': 'blocking', 'first_content_s': elapsed, 'total_s': elapsed, 'cached': hit is not None,
+               'refilled': refilled, 'truncated': truncated, 'usage': usage}
+    return parsed, metrics
+
+
+# Structured output: the fields come back as the input of a forced tool call
+# (see parsing.tool_schema) rather than as labelled text
+def generate_structured(client, prompt, tool, max_tokens=MAX_TOKENS, cache=None, prompt_for=None, trace=NULL_TRACE):
+    start = time.perf_counter()
+    with trace.span('cache_lookup'):
+        hit = cached_response(cache, prompt, max_tokens, tool)
+    refilled = []
+    truncated = False
+    usage = new_usage()
+    if hit is not None:
+        parsed = hit['parsed']
+    else:
+        with trace.span('api'):
+            message = client.messages.create(**request_params(
+                prompt, max_tokens, tools=[tool], tool_choice={"type": "tool", "name": tool['name']}))
+        add_usage(usage, message.usage)
+        with trace.span('parse'):
+            data = tool_input(message)
+            parsed = parse_tool_use(message)
+        text = json.dumps(data) if data is not None else ''.join(
+            block.text for block in message.content if block.type == 'text')
+        truncated = drop_truncated(parsed, message, list(data) if data else None)
+        if prompt_for:
+            refilled = missing_fields(parsed)
+            text += '\n' + fill_missing(client, parsed, prompt_for, usage=usage, trace=trace)
+        if not truncated:
+            store_response(cache, prompt, max_tokens, text, parsed, tool=tool)
+    elapsed = time.perf_counter() - start
+    metrics = {'mode': 'structured', 'first_content_s': elapsed, 'total_s': elapsed, 'cached': hit is not None,
+               'refilled': refilled, 'truncated': truncated, 'usage': usage}
+    return parsed, metrics
+
+
+# Streams the completion and calls on_field(label, value) for each field as
+# soon as it closes. Time to the first closed field is what the user actually
+# waits for, so it is recorded alongside the total.
+def stream_newsletter(client, prompt, on_field, max_tokens=MAX_TOKENS, cache=None, prompt_for=None,
+                      trace=NULL_TRACE):
+    start = time.perf_counter()
+    first_content_s = None
+    parser = IncrementalParser()
+    with trace.span('cache_lookup'):
+        hit = cached_response(cache, prompt, max_tokens)
+    refilled = []
+    truncated = False
+    usage = new_usage()
+
+    def emit(closed):
+        nonlocal first_content_s
+        for label, value in closed:
+            if first_content_s is None:
+                first_content_s = time.perf_counter() - start
+            on_field(label, value)
+
+    if hit is not None:
+        parser.parsed = dict(hit['parsed'])
+        emit([(label, parser.parsed[label]) for label in LABELS if label in parser.parsed])
+    else:
+        chunks = []
+        # 'api' covers the whole stream; parsing and the on_field callbacks
+        # run inside it and are also reported on their own
+        with trace.span('api'):
+            with client.messages.stream(**request_params(prompt, max_tokens)) as stream:
+                for text in stream.text_stream:
+                    if not chunks:
+                        trace.add('first_token', time.perf_counter() - start)
+                    chunks.append(text)
+                    with trace.span('parse'):
+                        closed = parser.feed(text)
+                    emit(closed)
+                final = stream.get_final_message()
+                add_usage(usage, final.usage)
+        closed = parser.finish()
+        # The field still open when the stream was cut off is never shown
+        truncated = final.stop_reason == 'max_tokens'
+        if truncated and closed:
+            label, _ = closed.pop()
+            parser.parsed.pop(label, None)
+        emit(closed)
+        if prompt_for:
+            refilled = missing_fields(parser.parsed)
+            chunks.append('\n' + fill_missing(client, parser.parsed, prompt_for, on_field, usage, trace))
+        if not truncated:
+            store_response(cache, prompt, max_tokens, ''.join(chunks), parser.parsed)
+
+    total_s = time.perf_counter() - start
+    metrics = {
+        'mode': 'streaming',
+        'first_content_s': first_content_s if first_content_s is not None else total_s,
+        'total_s': total_s,
+        'cached': hit is not None,
+        'refilled': refilled,
+        'truncated': truncated,
+        'usage': usage,
+    }
+    return parser.parsed, metrics
+
+
+class SectionError(Exception):
+    def __init__(self, failures, parsed):
+        self.failures = failures
+        self.parsed = parsed
+        names = ', '.join(sorted(failures))
+        super().__init__(f"Could not generate section(s): {names}")
+
+
+# Writes each section as its own request so wall-clock time tracks the
+# slowest section instead of the sum. section_prompts maps a SECTIONS name to
+# (labels, prompt, max_tokens). A section that errors or comes back missing labels is
+# retried on its own; the ones that succeeded are kept.
+async def generate_sections(async_client, section_prompts, on_field=None,
+                            max_concurrency=3, retries=2, cache=None, trace=NULL_TRACE):
+    start = time.perf_counter()
+    first_content_s = None
+    semaphore = asyncio.Semaphore(max_concurrency)
+    parsed = {}
+    cached_sections = 0
+    usage = new_usage()
+
+    async def run_section(name, labels, prompt, max_tokens):
+        nonlocal first_content_s, cached_sections
+        last_error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+            try:
+                hit = cached_response(cache, prompt, max_tokens) if attempt == 0 else None
+                if hit is not None:
+                    result = hit['parsed']
+                    cached_sections += 1
+                else:
+                    async with semaphore:
+                        with trace.span(f'api.{name}'):
+                            message = await async_client.messages.create(**request_params(prompt, max_tokens))
+                    add_usage(usage, message.usage)
+                    text = message.content[0].text
+                    with trace.span('parse'):
+                        result = parse_response(text)
+                    # A cut-off section comes back missing a label and is retried
+                    drop_truncated(result, message)
+                missing = missing_fields(result, labels)
+                if missing:
+                    raise ValueError(f"response was missing {', '.join(missing)}")
+                if hit is None:
+                    store_response(cache, prompt, max_tokens, text, result, labels)
+            except Exception as e:
+                if is_auth_error(e):
+                    raise
+                last_error = e
+                continue
+            if first_content_s is None:
+                first_content_s = time.perf_counter() - start
+            for label in labels:
+                parsed[label] = result[label]
+                if on_field:
+                    on_field(label, result[label])
+            return None
+        return last_error
+
+    names = list(section_prompts)
+    errors = await asyncio.gather(*(run_section(name, *section_prompts[name]) for name in names))
+    failures = {name: error for name, error in zip(names, errors) if error is not None}
+    if failures:
+        raise SectionError(failures, parsed)
+
+    total_s = time.perf_counter() - start
+    metrics = {
+        'mode': 'parallel',
+        'first_content_s': first_content_s if first_content_s is not None else total_s,
+        'total_s': total_s,
+        'cached': cached_sections == len(names),
+        'usage': usage,
+    }
+    return parsed, metrics
+
+
+# Small targeted request used to rewrite one part of a finished newsletter
+def rewrite_fields(client, prompt, labels, max_tokens=None, trace=NULL_TRACE):
+    start = time.perf_counter()
+    with trace.span('api'):
+        message = client.messages.create(**request_params(prompt, max_tokens or max_tokens_for(labels)))
+    with trace.span('parse'):
+        parsed = parse_response(message.content[0].text)
+    drop_truncated(parsed, message)
+    missing = missing_fields(parsed, labels)
+    if missing:
+        raise ValueError(f"response was missing {', '.join(missing)}")
+    metrics = {'mode': 'rewrite', 'total_s': time.perf_counter() - start,
+               'usage': add_usage(new_usage(), message.usage)}
+    return {label: parsed[label] for label in labels}, metrics
@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import io
+import threading
+import zipfile
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from functools import cached_property
+
+# The template is 600px wide; images are kept sharp on 2x screens
+MAX_WIDTH = 1200
+SIZE_BUDGET = 150 * 1024
+MIN_WIDTH = 300
+JPEG_QUALITIES = (85, 75, 65, 55, 45)
+
+EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif', 'image/webp': 'webp'}
+
+
+# An upload that can't be used: corrupt, not really an image, or too many
+# pixels to decode safely
+class ImageError(ValueError):
+    pass
+
+
+@dataclass(eq=False)
+class PreparedImage:
+    data: bytes
+    mime: str
+    digest: str
+    original_size: int
+    width: int = None
+    height: int = None
+    # Set when the image couldn't be processed and is passed through as-is
+    note: str = field(default='')
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def cid(self):
+        return f"{self.digest[:16]}@be-newsie"
+
+    @property
+    def filename(self):
+        return f"{self.digest[:16]}.{EXTENSIONS.get(self.mime, 'bin')}"
+
+    # Built once per image; reruns hand the same string to the renderer
+    @cached_property
+    def data_uri(self):
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode()}"
+
+
+# Uploads come back on every rerun, so prepared images are kept by content
+# hash and only decoded and recompressed the first time they're seen
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_ENTRIES = 32
+
+
+def prepare_image(data, mime, max_width=MAX_WIDTH, budget=SIZE_BUDGET):
+    digest = hashlib.sha256(data).hexdigest()
+    key = (digest, max_width, budget)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    image = _process(data, mime, digest, max_width, budget)
+    with _cache_lock:
+        _cache[key] = image
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return image
+
+
+def _process(data, mime, digest, max_width, budget):
+    try:
+        from PIL import Image, ImageOps, UnidentifiedImageError
+    except ImportError:
+        return PreparedImage(data, mime, digest, len(data), note="Pillow is not installed, image left as uploaded")
+
+    try:
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        original_width, original_height = img.size
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+    except UnidentifiedImageError as e:
+        raise ImageError("not a PNG, JPEG or other supported image") from e
+    except Image.DecompressionBombError as e:
+        raise ImageError("too many pixels to process safely") from e
+    except OSError as e:
+        raise ImageError(f"the file looks damaged ({e})") from e
+    resized = img.width > max_width
+    if resized:
+        img = img.resize((max_width, round(img.height * max_width / img.width)), Image.LANCZOS)
+
+    # Step quality down first, then size, until the encoded image fits
+    while True:
+        for quality in ((None,) if has_alpha else JPEG_QUALITIES):
+            out = io.BytesIO()
+            if has_alpha:
+                img.save(out, 'PNG', optimize=True)
+            else:
+                img.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+            if out.tell() <= budget:
+                break
+        if out.tell() <= budget or img.width <= MIN_WIDTH:
+            break
+        img = img.resize((round(img.width * 0.75), round(img.height * 0.75)), Image.LANCZOS)
+
+    encoded = out.getvalue()
+    out_mime = 'image/png' if has_alpha else 'image/jpeg'
+    if len(encoded) >= len(data) and mime in EXTENSIONS and not resized:
+        # Already small; recompressing would only lose quality. A resized
+        # image is kept even if bigger, since the width cap holds the layout.
+        return PreparedImage(data, mime, digest, len(data), original_width, original_height)
+    return PreparedImage(encoded, out_mime, digest, len(data), img.width, img.height)
+
+
+# Output modes for exported newsletters. The HTML is rendered with inline
+# data URIs; these swap each one for a cid: or file reference.
+
+def to_cid_email(html, images, subject, plain_text):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg.set_content(plain_text)
+    for image in images:
+        html = html.replace(image.data_uri, f"cid:{image.cid}")
+    msg.add_alternative(html, subtype='html')
+    html_part = msg.get_payload()[1]
+    for image in images:
+        maintype, subtype = image.mime.split('/', 1)
+        html_part.add_related(image.data, maintype, subtype, cid=f"<{image.cid}>", filename=image.filename)
+    return msg.as_bytes()
+
+
+def to_external_files(html, images, directory='images'):
+    files = {}
+    for image in images:
+        path = f"{directory}/{image.filename}"
+        html = html.replace(image.data_uri, path)
+        files[path] = image.data
+    return html, files
+
+
+def to_zip(html, images, html_name='newsletter.html'):
+    html, files = to_external_files(html, images)
+    return zip_files(html, files, html_name)
+
+
+def zip_files(html, files, html_name='newsletter.html'):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(html_name, html)
+        for path, data in files.items():
+            # Already compressed, deflating again only costs time
+            zf.writestr(path, data, compress_type=zipfile.ZIP_STORED)
+    return out.getvalue()
+
+
+def format_bytes(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    if size < 1024:
+        return f"{size} B"
+    return f"{size / 1024:.0f} KB"
@@ -0,0 +1,129 @@
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from clients import api_key_id
+
+
+# One generation submitted to the JobQueue. work(on_field) runs on a pool
+# thread and returns the result; fields written so far are kept on the job
+# so a UI can poll them. state is whatever the submitter needs to pick the
+# job up again later, e.g. from a new session after a page reload.
+class Job:
+    def __init__(self, key, work, state=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.work = work
+        self.state = state or {}
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._fields = {}
+        self._lock = threading.Lock()
+
+    def on_field(self, label, value):
+        with self._lock:
+            self._fields[label] = value
+
+    def fields(self):
+        with self._lock:
+            return dict(self._fields)
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+
+# Bounded worker pool shared by every session. Each API key gets at most
+# per_key jobs on the pool at once; the rest wait in that key's queue, so
+# one busy key can't take every worker. Finished jobs are kept for ttl
+# seconds so they can still be picked up.
+class JobQueue:
+    def __init__(self, max_workers=8, per_key=2, ttl=3600):
+        self.max_workers = max_workers
+        self.per_key = per_key
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="newsie-job")
+        self._jobs = {}
+        self._pending = {}
+        self._active = {}
+        self._completed = 0
+        self._failed = 0
+        self._queue_wait_s = 0.0
+        self._lock = threading.Lock()
+
+    def submit(self, api_key, work, state=None):
+        job = Job(api_key_id(api_key), work, state)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            self._pending.setdefault(job.key, deque()).append(job)
+            self._dispatch(job.key)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Jobs ahead of this one in its key's queue
+    def position(self, job):
+        with self._lock:
+            pending = self._pending.get(job.key, ())
+            return next((i for i, queued in enumerate(pending) if queued is job), 0)
+
+    # Called with the lock held
+    def _dispatch(self, key):
+        pending = self._pending.get(key)
+        while pending and self._active.get(key, 0) < self.per_key:
+            job = pending.popleft()
+            self._active[key] = self._active.get(key, 0) + 1
+            self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        job.started = time.time()
+        job.status = 'running'
+        status = 'failed'
+        try:
+            job.result = job.work(job.on_field)
+            status = 'done'
+        except Exception as e:
+            job.error = e
+        finally:
+            # finished goes first: anything that sees the job as done can rely on it
+            job.finished = time.time()
+            job.status = status
+            job.work = None
+            with self._lock:
+                self._active[job.key] -= 1
+                self._queue_wait_s += job.started - job.created
+                if job.status == 'done':
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                self._dispatch(job.key)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.done and job.finished is not None and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def metrics(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            finished = self._completed + self._failed
+            return {
+                'queued': statuses.count('queued'),
+                'running': statuses.count('running'),
+                'completed': self._completed,
+                'failed': self._failed,
+                'workers': self.max_workers,
+                'per_key': self.per_key,
+                'busiest_key': max(self._active.values(), default=0),
+                'avg_queue_wait_s': self._queue_wait_s / finished if finished else 0.0,
+            }
@@ -0,0 +1,183 @@
+import base64
+import hashlib
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+# Gmail clips anything past ~102 KB of HTML behind "[Message clipped]"
+GMAIL_CLIP_BYTES = 102 * 1024
+WARN_BYTES = 90 * 1024
+INLINE_IMAGE_BYTES = 20 * 1024
+
+STYLE_ATTR = re.compile(r'style="([^"]*)"')
+HEX_COLOR = re.compile(r'#([0-9a-fA-F])\1([0-9a-fA-F])\2([0-9a-fA-F])\3\b')
+ZERO_LENGTH = re.compile(r'(?<![\w.#-])0(?:px|em|rem|pt)\b')
+BOX_PROPERTIES = {'margin', 'padding', 'border-radius', 'border-width'}
+# Outlook's <!--[if mso]> blocks are instructions, not comments
+COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.S)
+BETWEEN_TAGS = re.compile(r'>\s+<')
+DATA_URI = re.compile(r'data:(image/[\w.+-]+);base64,[A-Za-z0-9+/=]+')
+# Folder the moved images are downloaded in, to upload to image_base_url
+IMAGE_DIR = 'images/'
+
+
+# Images are only moved out of the HTML when image_base_url says where
+# they'll be hosted: a relative link breaks once the HTML is pasted into an
+# email service or sent, so without one every image stays inline.
+@dataclass(frozen=True)
+class SizeBudget:
+    warn_bytes: int = WARN_BYTES
+    limit_bytes: int = GMAIL_CLIP_BYTES
+    inline_image_bytes: int = INLINE_IMAGE_BYTES
+    image_base_url: str = ''
+
+
+# "20px 40px 15px 40px" -> "20px 40px 15px", and so on down while the
+# shorthand means the same thing
+def _shorten_box(value):
+    parts = value.split()
+    if len(parts) == 4 and parts[1] == parts[3]:
+        parts = parts[:3]
+    if len(parts) == 3 and parts[0] == parts[2]:
+        parts = parts[:2]
+    if len(parts) == 2 and parts[0] == parts[1]:
+        parts = parts[:1]
+    return ' '.join(parts)
+
+
+# Same declarations in fewer bytes, in a form every client reads: no spare
+# whitespace, short hex colors, unitless zeros, trimmed box shorthands, and
+# exact repeats dropped. A property set twice with different values is kept
+# as is, since that's how email CSS gives older clients a fallback
+# (background:#123;background:linear-gradient(...)). The same few dozen
+# style strings come up on every render, so results are cached.
+@lru_cache(maxsize=1024)
+def shorten_style(style):
+    # data: URLs have semicolons of their own
+    if 'url(' in style:
+        return style.strip()
+    declarations = {}
+    for declaration in style.split(';'):
+        prop, sep, value = declaration.partition(':')
+        prop = prop.strip().lower()
+        if not sep or not prop:
+            continue
+        value = ' '.join(value.split()).replace(', ', ',')
+        value = HEX_COLOR.sub(r'#\1\2\3', value)
+        value = ZERO_LENGTH.sub('0', value)
+        if prop in BOX_PROPERTIES:
+            value = _shorten_box(value)
+        # Only the last copy of an exact repeat counts, so that's the one kept
+        declarations.pop((prop, value), None)
+        declarations[(prop, value)] = True
+    return ';'.join(f"{prop}:{value}" for prop, value in declarations)
+
+
+def shorten_styles(html):
+    return STYLE_ATTR.sub(lambda match: f'style="{shorten_style(match.group(1))}"', html)
+
+
+# Styles used more than once become classes in one <style> block. Smaller,
+# but only for clients that keep <style> (Gmail, Apple Mail, Outlook); some
+# webmail and older apps drop it and show the email unstyled, so it's opt-in.
+def style_classes(html, min_uses=2, min_length=24):
+    counts = Counter(STYLE_ATTR.findall(html))
+    classes = {}
+    for style, uses in counts.most_common():
+        if uses >= min_uses and len(style) >= min_length:
+            classes[style] = f"n{len(classes)}"
+    if not classes or '</head>' not in html:
+        return html
+    css = ''.join(f".{name}{{{style}}}" for style, name in classes.items())
+    html = STYLE_ATTR.sub(lambda match: f'class="{classes[match.group(1)]}"' if match.group(1) in classes
+                          else match.group(0), html)
+    return html.replace('</head>', f"<style>{css}</style></head>", 1)
+
+
+# Drops comments and the whitespace between tags. Line breaks are kept as
+# single newlines, so no line gets near SMTP's 998 character limit.
+def minify_whitespace(html):
+    html = COMMENT.sub('', html)
+    return BETWEEN_TAGS.sub(lambda match: '>\n<' if '\n' in match.group(0) else '><', html)
+
+
+# Styles and whitespace only; the same HTML, just smaller
+def compact_html(html, classes=False):
+    html = minify_whitespace(shorten_styles(html))
+    return style_classes(html) if classes else html
+
+
+def _image_name(uri):
+    mime = uri[5:uri.index(';')]
+    return f"{hashlib.sha256(uri.encode('ascii')).hexdigest()[:16]}.{mime.split('/')[1].split('+')[0]}"
+
+
+# Inline images bigger than max_bytes (as they sit in the HTML) are swapped
+# for a link to the same file under base_url, where it's to be hosted.
+# Returns the HTML and the moved images, as {link: (data URI, image bytes)}.
+def move_images(html, max_bytes, base_url):
+    moved = {}
+
+    def replace(match):
+        uri = match.group(0)
+        if len(uri) <= max_bytes:
+            return uri
+        link = base_url + _image_name(uri)
+        if link not in moved:
+            moved[link] = (uri, base64.b64decode(uri[uri.index(',') + 1:]))
+        return link
+
+    return DATA_URI.sub(replace, html), moved
+
+
+# An exported newsletter and what it weighs. html is what gets downloaded;
+# files are the images moved out of it, by their path in the download.
+@dataclass
+class OptimizedHtml:
+    html: str
+    original_bytes: int
+    budget: SizeBudget
+    saved: dict = field(default_factory=dict)
+    moved: dict = field(default_factory=dict)
+
+    @property
+    def size(self):
+        return len(self.html.encode('utf-8'))
+
+    @property
+    def files(self):
+        return {IMAGE_DIR + link.rsplit('/', 1)[-1]: data for link, (_, data) in self.moved.items()}
+
+    @property
+    def status(self):
+        if self.size > self.budget.limit_bytes:
+            return 'over'
+        if self.size > self.budget.warn_bytes:
+            return 'warn'
+        return 'ok'
+
+    # The same HTML with the moved images back inline, so it can be shown
+    # (or sent as .eml, or zipped with every image) without hosting anything
+    def inline_html(self):
+        html = self.html
+        for link, (uri, _) in self.moved.items():
+            html = html.replace(link, uri)
+        return html
+
+
+def optimize_html(html, budget=SizeBudget(), classes=False):
+    sizes = [('original', len(html.encode('utf-8')))]
+    html = shorten_styles(html)
+    sizes.append(('styles', len(html.encode('utf-8'))))
+    if classes:
+        html = style_classes(html)
+        sizes.append(('style_classes', len(html.encode('utf-8'))))
+    html = minify_whitespace(html)
+    sizes.append(('whitespace', len(html.encode('utf-8'))))
+    moved = {}
+    if budget.image_base_url:
+        html, moved = move_images(html, budget.inline_image_bytes, budget.image_base_url)
+        sizes.append(('images', len(html.encode('utf-8'))))
+    saved = {step: before - after for (_, before), (step, after) in zip(sizes, sizes[1:])}
+    return OptimizedHtml(html, sizes[0][1], budget, saved, moved)
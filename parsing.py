@@ -0,0 +1,142 @@
+import json
+import re
+
+from prompts import LABELS
+
+# One pattern for every label line. Tolerates what models tend to add around
+# the labels: markdown bold/italics, headings, bullets, numbering, spaces
+# instead of underscores and lowercase. The captured name is only accepted
+# if it normalizes to one of the expected labels.
+LABEL_LINE = re.compile(r"""
+    ^\s*
+    (?:[#>]\s*|[*\-•]\s+|\d+[.)]\s*)*   # heading / quote / bullet / "1." markers
+    ([*_]*)                            # opening bold or italics
+    ([A-Za-z][A-Za-z0-9 _]*?)          # the label itself
+    (?:
+        (?:\1\s*[:：]|\s*[:：](?:\s*\1)?)\s*(.*)   # colon, closing bold on either side
+      | \1\s*                          # or a label alone on its line, as a heading
+    )$
+""", re.VERBOSE)
+
+# Separator lines carry no content
+RULE_LINE = re.compile(r'^\s*(?:[-*_=]\s*){3,}$')
+
+
+def normalize_label(name):
+    return re.sub(r'[\s_]+', '', name).upper()
+
+
+def _strip_value(value):
+    value = value.strip()
+    # The model sometimes echoes the "[...]" placeholders from the format spec,
+    # or wraps a whole value in emphasis
+    for start, end in (('[', ']'), ('**', '**'), ('*', '*'), ('_', '_')):
+        if len(value) > len(start) + len(end) and value.startswith(start) and value.endswith(end):
+            value = value[len(start):-len(end)].strip()
+    return value
+
+
+# Label parser that can be fed the response a chunk at a time. A field is
+# finished ("closed") as soon as the next label starts, so callers can show
+# it without waiting for the rest of the completion. Each line is matched
+# once against LABEL_LINE.
+class IncrementalParser:
+    def __init__(self, keys=LABELS):
+        self.keys = {normalize_label(key): key for key in keys}
+        self.parsed = {}
+        self.current_key = None
+        self.current_val = []
+        self._buffer = ""
+
+    def feed(self, chunk):
+        closed = []
+        self._buffer += chunk
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            closed.extend(self._feed_line(line))
+        return closed
+
+    def finish(self):
+        closed = []
+        if self._buffer:
+            closed.extend(self._feed_line(self._buffer))
+            self._buffer = ""
+        closed.extend(self._close())
+        return closed
+
+    def _feed_line(self, line):
+        match = LABEL_LINE.match(line)
+        if match:
+            key = self.keys.get(normalize_label(match.group(2)))
+            if key:
+                closed = self._close()
+                self.current_key = key
+                value = match.group(3) or ''
+                # Bold that opened before the label can close at the end of the line
+                emphasis = match.group(1)
+                if emphasis and value.endswith(emphasis):
+                    value = value[:-len(emphasis)]
+                self.current_val = [value]
+                return closed
+        if self.current_key and not RULE_LINE.match(line):
+            self.current_val.append(line)
+        return []
+
+    def _close(self):
+        if not self.current_key:
+            return []
+        key = self.current_key
+        value = _strip_value(' '.join(part.strip() for part in self.current_val if part.strip()))
+        self.parsed[key] = value
+        self.current_key = None
+        self.current_val = []
+        return [(key, value)]
+
+
+def parse_response(content):
+    parser = IncrementalParser()
+    parser.feed(content)
+    parser.finish()
+    return parser.parsed
+
+
+# Labels that didn't come back, or came back empty, so that only those need
+# to be asked for again
+def missing_fields(parsed, labels=LABELS):
+    return [label for label in labels if not parsed.get(label)]
+
+
+# Structured output: the same fields requested as a forced tool call, so the
+# model fills a JSON object instead of writing labelled text
+TOOL_NAME = 'write_newsletter'
+
+
+def tool_schema(spec, labels=LABELS):
+    return {
+        'name': TOOL_NAME,
+        'description': "Write the requested newsletter fields.",
+        'input_schema': {
+            'type': 'object',
+            'properties': {label: {'type': 'string', 'description': spec[label].strip('[]')} for label in labels},
+            'required': list(labels),
+        },
+    }
+
+
+# The forced tool call's input, in the order the model wrote it, or None if
+# there wasn't one
+def tool_input(message):
+    for block in message.content:
+        if block.type == 'tool_use' and block.name == TOOL_NAME:
+            data = block.input
+            return json.loads(data) if isinstance(data, str) else data
+    return None
+
+
+def parse_tool_use(message, labels=LABELS):
+    data = tool_input(message)
+    if data is not None:
+        return {label: str(data[label]).strip() for label in labels if data.get(label)}
+    # Fall back to the text format if the model answered in prose anyway
+    text = ''.join(block.text for block in message.content if block.type == 'text')
+    return parse_response(text)
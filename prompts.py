@@ -0,0 +1,174 @@
+# Response labels, in the order the model is asked to write them, and the
+# session_state key each one is stored under
+FIELDS = [
+    ('SUBJECT_LINE_1', 'subj1'),
+    ('SUBJECT_LINE_2', 'subj2'),
+    ('SUBJECT_LINE_3', 'subj3'),
+    ('OPENING_HOOK', 'hook'),
+    ('ONE_MAIN_THING', 'main_thing'),
+    ('CEO_NOTE', 'ceo_note'),
+    ('PILLAR1_TITLE', 'p1_title'),
+    ('PILLAR1_CONTENT', 'p1_content'),
+    ('PILLAR2_TITLE', 'p2_title'),
+    ('PILLAR2_CONTENT', 'p2_content'),
+    ('PILLAR3_TITLE', 'p3_title'),
+    ('PILLAR3_CONTENT', 'p3_content'),
+    ('CTA_BUTTON', 'cta_btn'),
+    ('PS_TEXT', 'ps'),
+]
+
+LABELS = [label for label, _ in FIELDS]
+STATE_KEYS = dict(FIELDS)
+
+MODEL = "claude-sonnet-4-20250514"
+
+
+def length_instruction_for(length_option):
+    return "2-3 sentences" if "Standard" in length_option else "4-5 sentences"
+
+
+# Upper end of each length instruction, for sizing max_tokens
+MAX_SENTENCES = {"2-3 sentences": 3, "4-5 sentences": 5}
+
+
+# Newsletter sections that can be written independently of each other
+SECTIONS = {
+    'header': ['SUBJECT_LINE_1', 'SUBJECT_LINE_2', 'SUBJECT_LINE_3', 'OPENING_HOOK',
+               'ONE_MAIN_THING', 'CEO_NOTE'],
+    'pillar1': ['PILLAR1_TITLE', 'PILLAR1_CONTENT'],
+    'pillar2': ['PILLAR2_TITLE', 'PILLAR2_CONTENT'],
+    'pillar3': ['PILLAR3_TITLE', 'PILLAR3_CONTENT'],
+    'closing': ['CTA_BUTTON', 'PS_TEXT'],
+}
+
+
+def build_context(theme, ceo_bullets, cta_text, ps_input,
+                  pillar1_name, pillar1_topic, pillar2_name, pillar2_topic,
+                  pillar3_name, pillar3_topic):
+    return f"""THEME: {theme}
+KEY POINTS FROM LEADERSHIP: {ceo_bullets}
+CALL TO ACTION: {cta_text}
+P.S. TOPIC: {ps_input}
+
+CONTENT SECTIONS:
+1. {pillar1_name}: {pillar1_topic}
+2. {pillar2_name}: {pillar2_topic}
+3. {pillar3_name}: {pillar3_topic}"""
+
+
+# Notes from the optional web research stage (see research.py), added to the
+# per-issue context so the system block stays the same for every request
+def research_block(research):
+    if not research:
+        return ''
+    return f"""
+
+RESEARCH NOTES (recent web results on these topics; use what's relevant and accurate, don't include URLs):
+{research}"""
+
+
+# A past issue (labels to text, e.g. from the archive) as a few-shot example
+# of the voice to write in
+def example_block(example):
+    if not example:
+        return ''
+    lines = '\n'.join(f"{label}: {example[label]}" for label in LABELS if example.get(label))
+    return f"""
+
+EXAMPLE OF A PAST ISSUE (match its voice and structure, but don't reuse its wording or facts):
+{lines}"""
+
+
+# Format spec for every field. It doesn't mention anything specific to one
+# issue, so it can live in the cached system block; the request supplies
+# LENGTH and the content sections.
+FORMAT_SPEC = {
+    'SUBJECT_LINE_1': "[Curiosity-driven, 5-8 words]",
+    'SUBJECT_LINE_2': "[Different angle, 5-8 words]",
+    'SUBJECT_LINE_3': "[Third option, 5-8 words]",
+    'OPENING_HOOK': "[2-3 engaging sentences to open the newsletter]",
+    'ONE_MAIN_THING': "[LENGTH - the key takeaway]",
+    'CEO_NOTE': "[Personal, warm, LENGTH in first person voice]",
+    'PILLAR1_TITLE': "[Catchy headline for content section 1]",
+    'PILLAR1_CONTENT': "[LENGTH about content section 1]",
+    'PILLAR2_TITLE': "[Catchy headline for content section 2]",
+    'PILLAR2_CONTENT': "[LENGTH about content section 2]",
+    'PILLAR3_TITLE': "[Catchy headline for content section 3]",
+    'PILLAR3_CONTENT': "[LENGTH about content section 3]",
+    'CTA_BUTTON': "[3-5 words for button]",
+    'PS_TEXT': "[Engaging P.S. message]",
+}
+
+TONE = "TONE: Warm, direct, empowering. Like a trusted friend sharing what matters."
+
+FORMAT_LINES = '\n'.join(f"{label}: {FORMAT_SPEC[label]}" for label in LABELS)
+
+SYSTEM_PROMPT = f"""You write email newsletters for organizations. Each request gives you the organization, the theme and content sections for this issue, a LENGTH for the longer fields, and the FIELDS TO WRITE.
+
+Return content in this EXACT format (no extra text, just the labels and content):
+
+{FORMAT_LINES}
+
+Only write the labels listed under FIELDS TO WRITE, in the order above. LENGTH means the length given in the request.
+
+{TONE}"""
+
+# Sent identically with every request and marked for prompt caching, so
+# repeat generations only pay full price for the per-issue user turn
+SYSTEM = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+
+
+def build_prompt(org_name, theme, ceo_bullets, cta_text, ps_input,
+                 pillar1_name, pillar1_topic, pillar2_name, pillar2_topic,
+                 pillar3_name, pillar3_topic, length_instruction, labels=LABELS, research='', example=None):
+    context = build_context(theme, ceo_bullets, cta_text, ps_input,
+                            pillar1_name, pillar1_topic, pillar2_name, pillar2_topic,
+                            pillar3_name, pillar3_topic) + research_block(research) + example_block(example)
+    if list(labels) == LABELS:
+        intro = f"Write a newsletter for {org_name}."
+    else:
+        intro = (f"You are writing one part of a newsletter for {org_name}. "
+                 f"Other writers are handling the rest, so only write the fields below.")
+    return f"""{intro}
+
+{context}
+
+LENGTH: {length_instruction}
+
+FIELDS TO WRITE: {', '.join(labels)}"""
+
+
+# Parts of a finished newsletter that can be rewritten on their own in edit mode
+REWRITABLE = {
+    'hook': ['OPENING_HOOK'],
+    'main_thing': ['ONE_MAIN_THING'],
+    'ceo_note': ['CEO_NOTE'],
+    'pillar1': ['PILLAR1_TITLE', 'PILLAR1_CONTENT'],
+    'pillar2': ['PILLAR2_TITLE', 'PILLAR2_CONTENT'],
+    'pillar3': ['PILLAR3_TITLE', 'PILLAR3_CONTENT'],
+    'cta': ['CTA_BUTTON'],
+    'ps': ['PS_TEXT'],
+}
+
+
+# current maps labels to the newsletter as it stands, so the rewrite fits
+# in with the copy around it
+def build_rewrite_prompt(org_name, theme, ceo_bullets, cta_text, ps_input,
+                         pillar1_name, pillar1_topic, pillar2_name, pillar2_topic,
+                         pillar3_name, pillar3_topic, length_instruction, current, labels, research=''):
+    context = build_context(theme, ceo_bullets, cta_text, ps_input,
+                            pillar1_name, pillar1_topic, pillar2_name, pillar2_topic,
+                            pillar3_name, pillar3_topic) + research_block(research)
+    draft_lines = '\n'.join(f"{label}: {current.get(label, '')}" for label in LABELS)
+    return f"""Here is the current draft of a newsletter for {org_name}.
+
+{context}
+
+CURRENT DRAFT:
+{draft_lines}
+
+Write a fresh version of only the fields below. It should read differently from the current draft but still fit with the rest of the newsletter.
+
+LENGTH: {length_instruction}
+
+FIELDS TO WRITE: {', '.join(labels)}"""
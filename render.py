@@ -0,0 +1,347 @@
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+
+
+@dataclass(frozen=True)
+class Palette:
+    primary: str
+    secondary: str
+    accent: str
+    text_color: str
+
+
+@dataclass(frozen=True)
+class Org:
+    name: str
+    tagline: str
+    website: str
+    logo: str
+
+
+@dataclass(frozen=True)
+class Pillar:
+    name: str
+    title: str
+    content: str
+    img: str
+
+
+# Everything needed to render one newsletter. Frozen, so it and its parts can
+# key the fragment caches below.
+@dataclass(frozen=True)
+class Newsletter:
+    org: Org
+    palette: Palette
+    section_label: str
+    hook: str
+    main_thing: str
+    ceo_note: str
+    pillars: tuple
+    cta_btn: str
+    cta_link: str
+    ps: str
+    subjects: tuple = ()
+    # Footer links; the personalizer fills these in per recipient
+    unsubscribe_url: str = '#'
+    browser_url: str = '#'
+
+
+DEFAULT_PALETTE = Palette("#2C3E50", "#4F9DCB", "#F7C548", "#2C3E50")
+
+
+def newsletter_from_state(state):
+    return Newsletter(
+        org=Org(state['org_name'], state['org_tagline'], state['org_website'], state['org_logo']),
+        palette=Palette(state['primary'], state['secondary'], state['accent'], state['text_color']),
+        section_label=state['section_label'],
+        hook=state['hook'],
+        main_thing=state['main_thing'],
+        ceo_note=state['ceo_note'],
+        pillars=tuple(
+            Pillar(state[f'p{n}_name'], state[f'p{n}_title'], state[f'p{n}_content'], state[f'p{n}_img'])
+            for n in (1, 2, 3)
+        ),
+        cta_btn=state['cta_btn'],
+        cta_link=state['cta_link'],
+        ps=state['ps'],
+        subjects=(state['subj1'], state['subj2'], state['subj3']),
+    )
+
+
+# A finished newsletter as JSON, so it can be personalized (or re-rendered)
+# outside the app
+def newsletter_to_json(doc):
+    return json.dumps(asdict(doc), ensure_ascii=False, indent=1)
+
+
+def newsletter_from_json(text):
+    data = json.loads(text)
+    return Newsletter(**{
+        **data,
+        'org': Org(**data['org']),
+        'palette': Palette(**data['palette']),
+        'pillars': tuple(Pillar(**pillar) for pillar in data['pillars']),
+        'subjects': tuple(data.get('subjects', ())),
+    })
+
+
+# Stable fingerprint of everything that goes into the rendered email, so
+# edit mode can tell whether anything actually changed since the last render
+def content_hash(doc):
+    return hashlib.sha256(repr(doc).encode('utf-8')).hexdigest()
+
+
+# Section templates. Brand colors are filled in once per palette by
+# compile_templates; the remaining {fields} are filled per render.
+TEMPLATES = {
+    'open': """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"></head>
+<body style="margin: 0; padding: 0; background-color: #f5f5f5; font-family: Georgia, 'Times New Roman', serif;">
+<table width="100%" cellpadding="0" cellspacing="0" style="background-color: #f5f5f5; padding: 20px 0;">
+<tr><td align="center">
+<table width="600" cellpadding="0" cellspacing="0" style="background-color: #ffffff; border-radius: 12px; overflow: hidden; box-shadow: 0 4px 15px rgba(0,0,0,0.08);">""",
+
+    'header': """<!-- Header -->
+<tr>
+<td style="background-color: {primary}; padding: 35px 40px; text-align: center;">
+{logo_html}
+<h1 style="color: #ffffff; margin: 0; font-size: 26px; font-weight: 700; letter-spacing: 0.5px;">{org_name}</h1>
+<p style="color: {accent}; margin: 8px 0 0 0; font-size: 13px; letter-spacing: 2px;">{org_tagline}</p>
+</td>
+</tr>""",
+
+    'hook': """<!-- Opening Hook -->
+<tr>
+<td style="padding: 35px 40px 25px 40px;">
+<p style="font-size: 17px; line-height: 1.75; color: {text_color}; margin: 0;">{hook}</p>
+</td>
+</tr>""",
+
+    'main_thing': """<!-- One Main Thing -->
+<tr>
+<td style="padding: 10px 40px 25px 40px;">
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="background-color: #fffbf0; border-left: 4px solid {accent}; padding: 22px 25px; border-radius: 0 8px 8px 0;">
+<p style="color: {accent}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 10px 0;">✨ The One Thing</p>
+<p style="font-size: 15px; line-height: 1.65; color: {text_color}; margin: 0;">{main_thing}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>""",
+
+    'ceo_note': """<!-- CEO Note -->
+<tr>
+<td style="padding: 10px 40px 25px 40px;">
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="background-color: #f8f9fa; border-radius: 8px; padding: 25px;">
+<p style="color: {primary}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 12px 0;">A Note From Our Team</p>
+<p style="font-size: 15px; line-height: 1.7; color: {text_color}; margin: 0; font-style: italic;">{ceo_note}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>""",
+
+    'section_label': """<!-- Section Label -->
+<tr>
+<td style="padding: 15px 40px 5px 40px;">
+<p style="color: {primary}; font-size: 16px; font-weight: 700; text-align: center; margin: 0;">— {section_label} —</p>
+</td>
+</tr>""",
+
+    'pillar1': """<!-- Pillar 1 -->
+<tr>
+<td style="padding: 20px 40px 15px 40px;">
+{image_html}
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="border-bottom: 2px solid {secondary}; padding-bottom: 18px;">
+<p style="color: {secondary}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 6px 0;">{name}</p>
+<p style="color: {primary}; font-size: 16px; font-weight: 700; margin: 0 0 8px 0;">{title}</p>
+<p style="font-size: 14px; line-height: 1.65; color: {text_color}; margin: 0;">{content}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>""",
+
+    'pillar2': """<!-- Pillar 2 -->
+<tr>
+<td style="padding: 20px 40px 15px 40px;">
+{image_html}
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="border-bottom: 2px solid {accent}; padding-bottom: 18px;">
+<p style="color: {accent}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 6px 0;">{name}</p>
+<p style="color: {primary}; font-size: 16px; font-weight: 700; margin: 0 0 8px 0;">{title}</p>
+<p style="font-size: 14px; line-height: 1.65; color: {text_color}; margin: 0;">{content}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>""",
+
+    'pillar3': """<!-- Pillar 3 -->
+<tr>
+<td style="padding: 20px 40px 15px 40px;">
+{image_html}
+<table width="100%" cellpadding="0" cellspacing="0">
+<tr>
+<td style="padding-bottom: 18px;">
+<p style="color: {primary}; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 2px; margin: 0 0 6px 0;">{name}</p>
+<p style="color: {primary}; font-size: 16px; font-weight: 700; margin: 0 0 8px 0;">{title}</p>
+<p style="font-size: 14px; line-height: 1.65; color: {text_color}; margin: 0;">{content}</p>
+</td>
+</tr>
+</table>
+</td>
+</tr>""",
+
+    'cta': """<!-- CTA Button -->
+<tr>
+<td style="padding: 25px 40px 30px 40px; text-align: center;">
+<a href="{cta_link}" style="display: inline-block; background-color: {accent}; color: {primary}; font-size: 15px; font-weight: 700; text-decoration: none; padding: 16px 45px; border-radius: 6px; letter-spacing: 0.5px;">{cta_btn}</a>
+</td>
+</tr>""",
+
+    'ps': """<!-- PS Section -->
+<tr>
+<td style="padding: 20px 40px 30px 40px; border-top: 1px solid #eee;">
+<p style="font-size: 14px; line-height: 1.6; color: #7C7C7C; margin: 0;"><strong>P.S.</strong> {ps}</p>
+</td>
+</tr>""",
+
+    'footer': """<!-- Footer -->
+<tr>
+<td style="background-color: {primary}; padding: 25px 40px; text-align: center;">
+<p style="color: #ffffff; font-size: 12px; margin: 0 0 8px 0;">{org_line}</p>
+<p style="color: #aaa; font-size: 11px; margin: 0;">
+<a href="{unsubscribe_url}" style="color: {secondary}; text-decoration: none;">Unsubscribe</a> · 
+<a href="{browser_url}" style="color: {secondary}; text-decoration: none;">View in browser</a>
+</p>
+</td>
+</tr>""",
+
+    'close': """</table>
+</td></tr>
+</table>
+</body>
+</html>""",
+}
+
+
+# Leaves any placeholder that isn't a brand color for the per-render pass
+class _KeepMissing(dict):
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+@lru_cache(maxsize=32)
+def compile_templates(palette):
+    colors = _KeepMissing(primary=palette.primary, secondary=palette.secondary,
+                          accent=palette.accent, text_color=palette.text_color)
+    compiled = {name: template.format_map(colors) for name, template in TEMPLATES.items()}
+    # Pillars are split around their image so a text edit never copies it
+    for n in (1, 2, 3):
+        top, _, body = compiled.pop(f'pillar{n}').partition('{image_html}')
+        compiled[f'pillar{n}_top'] = top
+        compiled[f'pillar{n}'] = body
+    return compiled
+
+
+def get_image_html(image_src, section_name):
+    if image_src:
+        return f'<img src="{image_src}" alt="{section_name}" style="width: 100%; height: 160px; object-fit: cover; border-radius: 8px; margin-bottom: 12px;">'
+    return f'<div style="width: 100%; height: 120px; background: linear-gradient(135deg, #f8f9fa 0%, #e9ecef 100%); border-radius: 8px; margin-bottom: 12px; display: flex; align-items: center; justify-content: center; color: #adb5bd; font-size: 13px; border: 2px dashed #dee2e6;">📷 Add {section_name} image</div>'
+
+
+# Fragment renderers. Each one is cached on only the inputs its section uses,
+# so editing one field re-renders one fragment.
+@lru_cache(maxsize=64)
+def render_header(palette, org):
+    logo_html = f'<img src="{org.logo}" alt="{org.name}" style="max-height: 50px; margin-bottom: 10px;">' if org.logo else ''
+    return compile_templates(palette)['header'].format(
+        logo_html=logo_html,
+        org_name=org.name.upper() if org.name else 'YOUR ORGANIZATION',
+        org_tagline=org.tagline if org.tagline else '',
+    )
+
+
+@lru_cache(maxsize=256)
+def render_text_section(palette, section, text):
+    return compile_templates(palette)[section].format(**{section: text})
+
+
+@lru_cache(maxsize=8)
+def render_image(image_src, section_name):
+    return get_image_html(image_src, section_name)
+
+
+@lru_cache(maxsize=256)
+def render_pillar(palette, number, name, title, content):
+    return compile_templates(palette)[f'pillar{number}'].format(name=name, title=title, content=content)
+
+
+@lru_cache(maxsize=64)
+def render_cta(palette, cta_btn, cta_link):
+    return compile_templates(palette)['cta'].format(cta_btn=cta_btn, cta_link=cta_link or '#')
+
+
+@lru_cache(maxsize=64)
+def render_footer(palette, org, unsubscribe_url='#', browser_url='#'):
+    return compile_templates(palette)['footer'].format(
+        org_line=f"{org.name} {('| ' + org.website) if org.website else ''}",
+        unsubscribe_url=unsubscribe_url or '#',
+        browser_url=browser_url or '#',
+    )
+
+
+# Sections are joined once at the end; large inline images are only copied
+# into the final document, never into intermediate fragments.
+@lru_cache(maxsize=4)
+def render_newsletter(doc):
+    palette = doc.palette
+    templates = compile_templates(palette)
+    fragments = [
+        templates['open'],
+        render_header(palette, doc.org),
+        render_text_section(palette, 'hook', doc.hook),
+        render_text_section(palette, 'main_thing', doc.main_thing),
+        render_text_section(palette, 'ceo_note', doc.ceo_note),
+        render_text_section(palette, 'section_label', doc.section_label),
+    ]
+    parts = []
+    for fragment in fragments:
+        parts.extend((fragment, '\n\n'))
+    for n, pillar in enumerate(doc.pillars, 1):
+        parts.extend((
+            templates[f'pillar{n}_top'],
+            render_image(pillar.img, pillar.name),
+            render_pillar(palette, n, pillar.name, pillar.title, pillar.content),
+            '\n\n',
+        ))
+    parts.extend((
+        render_cta(palette, doc.cta_btn, doc.cta_link), '\n\n',
+        render_text_section(palette, 'ps', doc.ps), '\n\n',
+        render_footer(palette, doc.org, doc.unsubscribe_url, doc.browser_url), '\n\n',
+        templates['close'],
+    ))
+    return ''.join(parts)
+
+
+# with_subjects=False leaves out the subject line options, for the text part
+# of an email that's actually being sent
+def render_plain_text(doc, with_subjects=True):
+    subjects = '\n'.join(f"{n}. {subject}" for n, subject in enumerate(doc.subjects, 1))
+    pillars = '\n\n'.join(f"{p.name}: {p.title}\n{p.content}" for p in doc.pillars)
+    text = f"SUBJECT OPTIONS:\n{subjects}\n\n" if with_subjects else ''
+    text += f"""{doc.hook}\n\nTHE ONE THING:\n{doc.main_thing}\n\nFROM OUR TEAM:\n{doc.ceo_note}\n\n{pillars}\n\n{doc.cta_btn}: {doc.cta_link}\n\nP.S. {doc.ps}"""
+    if doc.unsubscribe_url and doc.unsubscribe_url != '#':
+        text += f"\n\nUnsubscribe: {doc.unsubscribe_url}"
+    return text
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from cache import SQLiteStore
+
+RESEARCH_PATH = os.path.join(".newsie_cache", "research.sqlite")
+TIME_BUDGET = 4.0
+MAX_RESULTS = 5
+TOKEN_BUDGET = 600
+CHARS_PER_TOKEN = 4
+
+
+@dataclass(frozen=True)
+class Snippet:
+    topic: str
+    title: str
+    url: str
+    body: str
+    rank: int
+
+
+# Search backends take a query and return [{'title', 'href', 'body'}, ...],
+# the shape duckduckgo-search returns
+class DuckDuckGoBackend:
+    name = 'duckduckgo'
+
+    def search(self, query, max_results=MAX_RESULTS):
+        from duckduckgo_search import DDGS
+
+        # Older duckduckgo-search versions return a generator, which can't be cached
+        return list(DDGS().text(query, max_results=max_results) or [])
+
+
+# Offline stand-in: results come from a JSON file mapping each query to its
+# result list, e.g. bench/research_fixtures.json
+class FixtureBackend:
+    name = 'fixtures'
+
+    def __init__(self, path):
+        with open(path, encoding='utf-8') as f:
+            self.results = {query.lower(): results for query, results in json.load(f).items()}
+
+    def search(self, query, max_results=MAX_RESULTS):
+        return self.results.get(query.lower(), [])[:max_results]
+
+
+# Search results on disk, keyed by backend and query. Queries come back
+# issue after issue for the same topics, so within the TTL they're free.
+class ResearchCache:
+    def __init__(self, path=RESEARCH_PATH, ttl=24 * 3600):
+        self.store = SQLiteStore(path, max_bytes=10 * 1024 * 1024, ttl=ttl)
+
+    @staticmethod
+    def key(backend, query, max_results):
+        normalized = ' '.join(query.lower().split())
+        return hashlib.sha256(json.dumps([backend.name, normalized, max_results]).encode('utf-8')).hexdigest()
+
+    def get(self, backend, query, max_results):
+        return self.store.get(self.key(backend, query, max_results))
+
+    def put(self, backend, query, max_results, results):
+        self.store.put(self.key(backend, query, max_results), results)
+
+
+# Sections are named by number as well, the way the prompt lists them, so
+# two with the same name keep their own research
+def research_queries(theme, pillar1_name, pillar1_topic, pillar2_name, pillar2_topic, pillar3_name, pillar3_topic):
+    queries = {'Theme': theme}
+    pillars = ((pillar1_name, pillar1_topic), (pillar2_name, pillar2_topic), (pillar3_name, pillar3_topic))
+    for n, (name, topic) in enumerate(pillars, 1):
+        if topic and topic.strip():
+            queries[f"{n}. {name.strip()}" if name and name.strip() else f"Section {n}"] = topic
+    return {topic: query.strip() for topic, query in queries.items() if query and query.strip()}
+
+
+# Runs every query at once and keeps whatever has come back when the time
+# budget runs out; a slow or failing search only costs its own topic.
+# queries maps a topic name to its search query.
+def search_all(queries, backend, cache=None, time_budget=TIME_BUDGET, max_results=MAX_RESULTS):
+    start = time.perf_counter()
+    results = {}
+    pending = {}
+    for topic, query in queries.items():
+        hit = cache.get(backend, query, max_results) if cache is not None else None
+        if hit is not None:
+            results[topic] = hit
+        else:
+            pending[topic] = query
+    stats = {'queries': len(queries), 'cached': len(results), 'timed_out': 0, 'failed': 0}
+    if pending:
+        executor = ThreadPoolExecutor(len(pending), thread_name_prefix="newsie-research")
+        futures = {executor.submit(backend.search, query, max_results): topic for topic, query in pending.items()}
+        done, not_done = wait(futures, timeout=time_budget)
+        # Don't wait for stragglers; their threads finish on their own
+        executor.shutdown(wait=False, cancel_futures=True)
+        stats['timed_out'] = len(not_done)
+        for future in done:
+            topic = futures[future]
+            try:
+                results[topic] = future.result()
+            except Exception:
+                stats['failed'] += 1
+                continue
+            if cache is not None:
+                cache.put(backend, pending[topic], max_results, results[topic])
+    stats['time_s'] = time.perf_counter() - start
+    return results, stats
+
+
+def _normalize(text):
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+def _domain(url):
+    return urlsplit(url).netloc.removeprefix('www.')
+
+
+# Drops repeats (the same page, or the same text on different pages) and
+# orders what's left round-robin by search rank, so every topic gets its
+# best results in before any topic gets its fifth
+def rank_snippets(results):
+    seen_urls = set()
+    seen_text = set()
+    by_topic = []
+    for topic, items in results.items():
+        kept = []
+        for rank, item in enumerate(items):
+            url = (item.get('href') or item.get('url') or '').rstrip('/')
+            body = ' '.join((item.get('body') or '').split())
+            if not body:
+                continue
+            text_key = _normalize(body)[:200]
+            if (url and url in seen_urls) or text_key in seen_text:
+                continue
+            seen_urls.add(url)
+            seen_text.add(text_key)
+            kept.append(Snippet(topic, ' '.join((item.get('title') or '').split()), url, body, rank))
+        by_topic.append(kept)
+    ranked = []
+    for rank in range(max((len(kept) for kept in by_topic), default=0)):
+        ranked.extend(kept[rank] for kept in by_topic if rank < len(kept))
+    return ranked
+
+
+# Research notes for the prompt, cut off at roughly token_budget tokens
+def format_research(snippets, token_budget=TOKEN_BUDGET):
+    budget = token_budget * CHARS_PER_TOKEN
+    lines = []
+    for snippet in snippets:
+        line = f"- [{snippet.topic}] {snippet.title}: {snippet.body}"
+        if snippet.url:
+            line += f" ({_domain(snippet.url)})"
+        if len(line) > budget:
+            if budget > 80:
+                lines.append(line[:budget - 1].rsplit(' ', 1)[0] + '…')
+            break
+        lines.append(line)
+        budget -= len(line) + 1
+    return '\n'.join(lines)
+
+
+def research(queries, backend, cache=None, time_budget=TIME_BUDGET, token_budget=TOKEN_BUDGET):
+    results, stats = search_all(queries, backend, cache, time_budget)
+    snippets = rank_snippets({topic: results[topic] for topic in queries if topic in results})
+    notes = format_research(snippets, token_budget)
+    stats['snippets'] = notes.count('\n') + 1 if notes else 0
+    return notes, stats
+
+
+# NEWSIE_RESEARCH_FIXTURES points at a fixture file to research offline
+def default_backend():
+    path = os.environ.get('NEWSIE_RESEARCH_FIXTURES')
+    return FixtureBackend(path) if path else DuckDuckGoBackend()
@@ -0,0 +1,65 @@
+import os
+import time
+import zipfile
+
+
+# Where batch and personalized output goes. Each file is written as soon as
+# it's ready rather than held until the end; write() takes str or bytes.
+class DirectorySink:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.path, name)
+        if os.path.dirname(name):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, bytes):
+            with open(path, 'wb') as f:
+                f.write(data)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(data)
+
+    def close(self):
+        pass
+
+
+class ZipSink:
+    def __init__(self, path, compression=zipfile.ZIP_DEFLATED, compresslevel=None):
+        self._zip = zipfile.ZipFile(path, 'w', compression, compresslevel=compresslevel)
+
+    def write(self, name, data):
+        self._zip.writestr(name, data)
+
+    def close(self):
+        self._zip.close()
+
+
+# One mbox file of .eml messages. Only whole RFC 822 messages belong here,
+# and the "From " line that starts each one is the only separator, so
+# bodies must not have lines starting with "From " (base64 parts never do).
+class MboxSink:
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._from_line = f"From MAILER-DAEMON {time.asctime(time.gmtime())}\n".encode('ascii')
+
+    def write(self, name, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._file.write(self._from_line)
+        self._file.write(data.rstrip(b'\n'))
+        self._file.write(b'\n\n')
+
+    def close(self):
+        self._file.close()
+
+
+# compress=False stores ZIP entries as they are, several times faster for
+# large outputs that don't shrink much anyway, like base64-heavy .eml files
+def open_sink(path, compress=True):
+    if path.endswith('.zip'):
+        return ZipSink(path, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+    if path.endswith('.mbox'):
+        return MboxSink(path)
+    return DirectorySink(path)
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+TRACE_DIR = ".newsie_traces"
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+
+
+# Timings for one unit of work (a generation, a rewrite, a render). Spans
+# with the same name add up, so a phase that runs in many small pieces,
+# like parsing a stream chunk by chunk, is reported as one total.
+class Trace:
+    enabled = True
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.spans = {}
+        self.calls = {}
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def incr(self, name, amount=1):
+        self.attrs[name] = self.attrs.get(name, 0) + amount
+
+    def to_dict(self):
+        return {
+            'trace': self.name,
+            'ts': self.started_at.isoformat(),
+            'total_s': time.perf_counter() - self._start,
+            'spans': dict(self.spans),
+            'calls': dict(self.calls),
+            **self.attrs,
+        }
+
+
+# Stands in for a Trace when tracing is off: every method is a no-op and
+# span() hands back one shared context manager, so instrumented code pays
+# for an attribute lookup and a call, nothing more.
+class NullTrace:
+    enabled = False
+    _span = nullcontext()
+
+    def span(self, name):
+        return self._span
+
+    def add(self, name, seconds):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+    def incr(self, name, amount=1):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+# Collects finished traces for the process. Each one is appended to a JSONL
+# file, and running totals are kept as Prometheus counters, optionally
+# rewritten to a text-format file for node_exporter's textfile collector.
+class Tracer:
+    def __init__(self, path=os.path.join(TRACE_DIR, "traces.jsonl"), prometheus_path=None, enabled=False):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.enabled = enabled
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def start(self, name, enabled=None, **attrs):
+        if not (self.enabled if enabled is None else enabled):
+            return NULL_TRACE
+        return Trace(name, **attrs)
+
+    def finish(self, trace):
+        if not trace.enabled:
+            return None
+        record = trace.to_dict()
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._count(record)
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+            if self.prometheus_path:
+                self._write_prometheus()
+        return record
+
+    def _count(self, record):
+        name = record['trace']
+        self._incr('newsie_traces_total', _labels(trace=name), 1)
+        self._incr('newsie_trace_seconds_total', _labels(trace=name), record['total_s'])
+        for span, seconds in record['spans'].items():
+            self._incr('newsie_span_seconds_total', _labels(trace=name, span=span), seconds)
+            self._incr('newsie_span_calls_total', _labels(trace=name, span=span), record['calls'][span])
+        for kind, tokens in (record.get('usage') or {}).items():
+            self._incr('newsie_tokens_total', _labels(type=kind), tokens)
+        for key in ('html_bytes', 'iframe_bytes'):
+            if record.get(key):
+                self._incr(f'newsie_{key}_total', _labels(trace=name), record[key])
+
+    def _incr(self, metric, labels, amount):
+        key = (metric, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def prometheus_text(self):
+        lines = []
+        seen = set()
+        for (metric, labels), value in sorted(self._counters.items()):
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+    # Written to a temp file and renamed, so a scrape never sees half a file
+    def _write_prometheus(self):
+        os.makedirs(os.path.dirname(self.prometheus_path) or '.', exist_ok=True)
+        tmp = self.prometheus_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, self.prometheus_path)
+
+
+# NEWSIE_TRACE=1 turns tracing on by default, NEWSIE_TRACE_FILE moves the
+# JSONL file and NEWSIE_TRACE_PROMETHEUS names a counters file to keep updated
+def default_tracer():
+    return Tracer(
+        path=os.environ.get('NEWSIE_TRACE_FILE', os.path.join(TRACE_DIR, "traces.jsonl")),
+        prometheus_path=os.environ.get('NEWSIE_TRACE_PROMETHEUS') or None,
+        enabled=os.environ.get('NEWSIE_TRACE', '') not in ('', '0', 'false'),
+    )